@@ -0,0 +1,388 @@
+"""
+Anomaly and trend precomputation over the uploaded data.
+
+Runs once at upload. Each dataset is turned into daily per-entity series
+(campaigns for META Ads, products for Sales, plus an account total), and
+vectorized rolling windows over them flag:
+
+- z-score outliers against the trailing window (spend spikes, CTR/ROAS drops,
+  revenue and unit swings)
+- day-over-day and week-over-week changes on the latest data
+
+Findings are ranked and stored with the session; prompts get only the top few,
+with an overview of totals and trends, instead of raw rows.
+"""
+
+import os
+import re
+import time
+from datetime import datetime
+
+from lazy_imports import pd, np
+from kpi_engine import find_column, fmt, numeric
+from retrieval import find_date_column, normalize, parse_dates
+
+ANOMALY_WINDOW_DAYS = int(os.getenv('ANOMALY_WINDOW_DAYS', '7'))
+ANOMALY_Z_THRESHOLD = float(os.getenv('ANOMALY_Z_THRESHOLD', '3'))
+ANOMALY_CHANGE_THRESHOLD = float(os.getenv('ANOMALY_CHANGE_THRESHOLD', '0.3'))
+ANOMALY_PROMPT_FINDINGS = int(os.getenv('ANOMALY_PROMPT_FINDINGS', '8'))
+MAX_STORED_FINDINGS = 100
+MAX_ENTITIES = 200
+MIN_BASELINE_DAYS = 3
+TOP_ENTITIES = 5
+MAX_SEVERITY = 10
+# Older findings count less: weight halves every RECENCY_HALF_LIFE_DAYS, down to RECENCY_FLOOR
+RECENCY_HALF_LIFE_DAYS = 30
+RECENCY_FLOOR = 0.25
+TOTAL = '__total__'
+
+# Per dataset: the entity column role, summed metrics, ratio metrics and the
+# metric that decides how much an entity matters
+DATASETS = {
+    'meta': {
+        'label': 'META Ads',
+        'entity': 'campaign',
+        'volumes': ['spend', 'impressions', 'clicks', 'purchase_value'],
+        'rates': {'ctr': ('clicks', 'impressions'), 'roas': ('purchase_value', 'spend')},
+        'weight': 'spend',
+        'outliers': ['spend', 'ctr', 'roas'],
+    },
+    'sales': {
+        'label': 'Sales',
+        'entity': 'product',
+        'volumes': ['revenue', 'quantity'],
+        'rates': {},
+        'weight': 'revenue',
+        'outliers': ['revenue', 'quantity'],
+    },
+}
+
+METRIC_LABELS = {
+    'spend': 'spend', 'impressions': 'impressions', 'clicks': 'clicks',
+    'purchase_value': 'purchase value', 'revenue': 'revenue', 'quantity': 'units sold',
+    'ctr': 'CTR', 'roas': 'ROAS',
+}
+
+# Question words that point at a metric, used to put matching findings first
+METRIC_KEYWORDS = {
+    'spend': r'spend|spent|cost|budget',
+    'ctr': r'ctr|click',
+    'roas': r'roas|return|efficien',
+    'purchase_value': r'conversion|purchase',
+    'revenue': r'revenue|sales|sold',
+    'quantity': r'units|quantity|sold',
+}
+
+
+def format_value(metric, value):
+    if value is None or pd.isna(value):
+        return 'n/a'
+    if metric == 'ctr':
+        return f"{value * 100:.2f}%"
+    if metric == 'roas':
+        return f"{value:.2f}x"
+    if metric in ('impressions', 'clicks', 'quantity'):
+        return fmt(value, 0)
+    return fmt(value)
+
+
+def _ratio(numerator, denominator):
+    return numerator / denominator.where(denominator > 0)
+
+
+def _daily_series(df, config):
+    """Wide daily frames (dates x entities) for every metric found in the dataset"""
+    date_col = find_date_column(df)
+    entity_col = find_column(df, config['entity'])
+    roles = {role: find_column(df, role) for role in config['volumes']}
+    roles = {role: col for role, col in roles.items() if col is not None}
+    if date_col is None or not roles:
+        return None, date_col, entity_col
+
+    days = parse_dates(df[date_col]).dt.normalize()
+    valid = days.notna().to_numpy()
+    data = pd.DataFrame({role: numeric(df[col]).to_numpy()[valid] for role, col in roles.items()})
+    data['day'] = days.to_numpy()[valid]
+    data['entity'] = df[entity_col].astype(str).to_numpy()[valid] if entity_col else TOTAL
+    if data.empty:
+        return None, date_col, entity_col
+
+    grouped = data.groupby(['day', 'entity'], sort=False)[list(roles)].sum()
+    calendar = pd.date_range(data['day'].min(), data['day'].max(), freq='D')
+
+    # Only the largest entities get their own series; all rows still count in the total
+    weight_role = config['weight'] if config['weight'] in roles else next(iter(roles))
+    entity_totals = grouped[weight_role].groupby(level='entity').sum().sort_values(ascending=False)
+    keep = [e for e in entity_totals.index[:MAX_ENTITIES] if e != TOTAL]
+
+    wide = {}
+    for role in roles:
+        matrix = grouped[role].unstack('entity', fill_value=0).reindex(calendar, fill_value=0)
+        total = matrix.sum(axis=1)
+        matrix = matrix[keep] if entity_col else matrix.iloc[:, 0:0]
+        matrix.insert(0, TOTAL, total)
+        wide[role] = matrix
+    for rate, (num, den) in config['rates'].items():
+        if num in wide and den in wide:
+            wide[rate] = _ratio(wide[num], wide[den])
+    return wide, date_col, entity_col
+
+
+def _share(wide, config):
+    """Each entity's share of the dataset's weight metric, used to scale severity"""
+    weight = wide.get(config['weight'])
+    if weight is None:
+        weight = wide[next(m for m in config['volumes'] if m in wide)]
+    totals = weight.sum()
+    overall = totals[TOTAL]
+    return (totals / overall).fillna(0).clip(0, 1) if overall else totals * 0 + 1
+
+
+def _recency(dates, anchor):
+    days_ago = (anchor - pd.DatetimeIndex(dates)).days.to_numpy()
+    return np.maximum(RECENCY_FLOOR, 0.5 ** (days_ago / RECENCY_HALF_LIFE_DAYS))
+
+
+def _outliers(name, metric, wide, config, share, anchor):
+    """Days that sit more than ANOMALY_Z_THRESHOLD deviations from the trailing window"""
+    series = wide[metric]
+    previous = series.shift(1)
+    mean = previous.rolling(ANOMALY_WINDOW_DAYS, min_periods=MIN_BASELINE_DAYS).mean()
+    # A week of samples gives a shaky deviation; estimate it over a longer stretch
+    std = previous.rolling(ANOMALY_WINDOW_DAYS * 4, min_periods=MIN_BASELINE_DAYS).std()
+    # A flat baseline would turn any wobble into a huge z-score; sums of counts
+    # and amounts vary at least like a Poisson count (sqrt of the mean)
+    floor = mean.abs() * 0.05
+    if metric not in config['rates']:
+        floor = np.maximum(floor, np.sqrt(mean.abs()))
+    std = std.where(std >= floor, floor)
+    z = (series - mean) / std.where(std > 0)
+
+    if metric in config['rates']:
+        # A rate on a fraction of the usual volume is noise, not a signal
+        den = wide[config['rates'][metric][1]]
+        den_mean = den.shift(1).rolling(ANOMALY_WINDOW_DAYS, min_periods=MIN_BASELINE_DAYS).mean()
+        z = z.where(den >= den_mean * 0.25)
+
+    flagged = z.stack()
+    flagged = flagged[flagged.abs() >= ANOMALY_Z_THRESHOLD]
+    if flagged.empty:
+        return []
+
+    frame = flagged.rename('z').reset_index()
+    frame.columns = ['date', 'entity', 'z']
+    frame['value'] = series.stack().reindex(flagged.index).to_numpy()
+    frame['expected'] = mean.stack().reindex(flagged.index).to_numpy()
+    frame['severity'] = np.minimum(frame['z'].abs() / ANOMALY_Z_THRESHOLD, MAX_SEVERITY)
+    frame['score'] = (frame['severity'] * np.sqrt(share.reindex(frame['entity']).to_numpy())
+                      * _recency(frame['date'], anchor))
+    # One finding per entity and direction: the most significant day
+    frame['direction'] = np.where(frame['z'] > 0, 'spike', 'drop')
+    frame = frame.sort_values('score', ascending=False).drop_duplicates(['entity', 'direction'])
+
+    return [{
+        'dataset': name,
+        'kind': 'outlier',
+        'metric': metric,
+        'direction': row.direction,
+        'entity': row.entity,
+        'date': row.date.date().isoformat(),
+        'value': float(row.value),
+        'expected': float(row.expected),
+        'z': round(float(row.z), 2),
+        'score': round(float(row.score), 3),
+    } for row in frame.itertuples(index=False)]
+
+
+def _period_values(wide, config, metric, start, end):
+    """Metric for a date slice per entity; rates are recomputed from the summed parts"""
+    if metric in config['rates']:
+        num, den = config['rates'][metric]
+        return _ratio(wide[num].iloc[start:end].sum(), wide[den].iloc[start:end].sum())
+    return wide[metric].iloc[start:end].sum()
+
+
+def _changes(name, wide, config, share, periods):
+    """Day-over-day and week-over-week changes ending on the latest day"""
+    metrics = [m for m in config['outliers'] if m in wide]
+    if not metrics:
+        return []
+    dates = wide[metrics[0]].index
+    findings = []
+    for period, days in periods:
+        if len(dates) < 2 * days:
+            continue
+        for metric in metrics:
+            current = _period_values(wide, config, metric, len(dates) - days, len(dates))
+            previous = _period_values(wide, config, metric, len(dates) - 2 * days, len(dates) - days)
+            change = (current - previous) / previous.where(previous > 0)
+            flagged = change[change.abs() >= ANOMALY_CHANGE_THRESHOLD].dropna()
+            for entity, pct_change in flagged.items():
+                severity = min(abs(pct_change) / ANOMALY_CHANGE_THRESHOLD, MAX_SEVERITY)
+                findings.append({
+                    'dataset': name,
+                    'kind': period,
+                    'metric': metric,
+                    'direction': 'spike' if pct_change > 0 else 'drop',
+                    'entity': entity,
+                    'date': dates[-1].date().isoformat(),
+                    'period_start': dates[len(dates) - days].date().isoformat(),
+                    'value': float(current[entity]),
+                    'expected': float(previous[entity]),
+                    'change_pct': round(float(pct_change), 4),
+                    'score': round(float(severity * np.sqrt(share.get(entity, 0))), 3),
+                })
+    return findings
+
+
+def _overview(wide, config, share, entity_col):
+    """Totals, latest week-over-week trend and the largest entities"""
+    metrics = [m for m in config['volumes'] + list(config['rates']) if m in wide]
+    dates = wide[metrics[0]].index
+    full = {m: _period_values(wide, config, m, 0, len(dates)) for m in metrics}
+
+    trends = []
+    days = ANOMALY_WINDOW_DAYS if len(dates) >= 2 * ANOMALY_WINDOW_DAYS else len(dates) // 2
+    if days:
+        for metric in metrics:
+            current = _period_values(wide, config, metric, len(dates) - days, len(dates))[TOTAL]
+            previous = _period_values(wide, config, metric, len(dates) - 2 * days, len(dates) - days)[TOTAL]
+            trends.append({
+                'metric': metric,
+                'days': days,
+                'current': None if pd.isna(current) else float(current),
+                'previous': None if pd.isna(previous) else float(previous),
+                'change_pct': round(float((current - previous) / previous), 4) if previous and not pd.isna(current) else None,
+            })
+
+    top = [e for e in share.drop(TOTAL, errors='ignore').sort_values(ascending=False).index[:TOP_ENTITIES]]
+    return {
+        'entity_column': entity_col,
+        'start': dates[0].date().isoformat(),
+        'end': dates[-1].date().isoformat(),
+        'totals': {m: None if pd.isna(full[m][TOTAL]) else float(full[m][TOTAL]) for m in metrics},
+        'trends': trends,
+        'top_entities': [{'entity': e, **{m: None if pd.isna(full[m][e]) else float(full[m][e]) for m in metrics}}
+                         for e in top],
+    }
+
+
+def _detect_dataset(name, df, periods):
+    """Return (overview, findings) for one dataset"""
+    config = DATASETS[name]
+    wide, date_col, entity_col = _daily_series(df, config)
+    if wide is None:
+        return {'date_column': date_col, 'entity_column': entity_col,
+                'skipped': 'no date column or metric columns found'}, []
+
+    share = _share(wide, config)
+    anchor = wide[next(iter(wide))].index[-1]
+    findings = []
+    for metric in config['outliers']:
+        if metric in wide:
+            findings += _outliers(name, metric, wide, config, share, anchor)
+    findings += _changes(name, wide, config, share, periods)
+    return {'date_column': date_col, **_overview(wide, config, share, entity_col)}, findings
+
+
+def detect_anomalies(meta_df, sales_df):
+    """Precompute ranked anomalies and a trend overview for both datasets"""
+    started = time.perf_counter()
+    result = {'computed_at': datetime.now().isoformat(), 'window_days': ANOMALY_WINDOW_DAYS,
+              'datasets': {}, 'findings': []}
+    periods = [('day_over_day', 1), ('week_over_week', ANOMALY_WINDOW_DAYS)]
+
+    for name, df in (('meta', meta_df), ('sales', sales_df)):
+        # One dataset failing must not lose the other's findings and overview
+        try:
+            summary, findings = _detect_dataset(name, df, periods)
+        except Exception as e:
+            print(f"⚠️ Anomaly detection failed for {name}: {e}")
+            summary, findings = {'skipped': f'detection failed: {e}'}, []
+        result['datasets'][name] = summary
+        result['findings'] += findings
+
+    result['findings'].sort(key=lambda f: f['score'], reverse=True)
+    result['finding_count'] = len(result['findings'])
+    result['findings'] = result['findings'][:MAX_STORED_FINDINGS]
+    result['elapsed_ms'] = round((time.perf_counter() - started) * 1000)
+    return result
+
+
+def describe_finding(finding, entity_col=None):
+    """One-line, prompt-ready description of a finding"""
+    metric, label = finding['metric'], METRIC_LABELS[finding['metric']]
+    if finding['entity'] == TOTAL:
+        who = f"All {DATASETS[finding['dataset']]['label']}"
+    else:
+        who = f"{entity_col or DATASETS[finding['dataset']]['entity']} '{finding['entity']}'"
+    value, expected = format_value(metric, finding['value']), format_value(metric, finding['expected'])
+
+    if finding['kind'] == 'outlier':
+        return (f"{who}: {label} {finding['direction']} on {finding['date']} - {value} vs "
+                f"{ANOMALY_WINDOW_DAYS}-day average {expected} (z={finding['z']:+.1f})")
+    if finding['kind'] == 'day_over_day':
+        return f"{who}: {label} {finding['change_pct'] * 100:+.0f}% day over day on {finding['date']} ({expected} -> {value})"
+    return (f"{who}: {label} {finding['change_pct'] * 100:+.0f}% week over week "
+            f"({expected} -> {value}, {finding['period_start']} to {finding['date']})")
+
+
+def _relevance(finding, question_text):
+    entity = normalize(finding['entity'])
+    score = 2 if finding['entity'] != TOTAL and entity and f' {entity} ' in f' {question_text} ' else 0
+    if re.search(METRIC_KEYWORDS.get(finding['metric'], r'$^'), question_text):
+        score += 1
+    return score
+
+
+def top_findings(anomalies, question=None, limit=ANOMALY_PROMPT_FINDINGS):
+    """Highest-ranked findings, with those about entities or metrics in the question first"""
+    findings = (anomalies or {}).get('findings', [])
+    if question:
+        question_text = normalize(question)
+        findings = sorted(findings, key=lambda f: (-_relevance(f, question_text), -f['score']))
+    return findings[:limit]
+
+
+def has_overview(anomalies):
+    """True when at least one dataset had dates and metrics to summarize"""
+    return any('totals' in summary for summary in (anomalies or {}).get('datasets', {}).values())
+
+
+def build_anomaly_context(anomalies, question=None, limit=ANOMALY_PROMPT_FINDINGS, overview=False):
+    """Prompt section with the top findings, optionally preceded by totals and trends"""
+    if not anomalies:
+        return ''
+    datasets = anomalies.get('datasets', {})
+    lines = []
+
+    if overview:
+        for name, summary in datasets.items():
+            if 'totals' not in summary:
+                continue
+            lines.append(f"{DATASETS[name]['label']} overview ({summary['start']} to {summary['end']}, all rows):")
+            lines.append('- Totals: ' + ', '.join(
+                f"{METRIC_LABELS[m]} {format_value(m, v)}" for m, v in summary['totals'].items()))
+            for trend in summary['trends']:
+                change = f"{trend['change_pct'] * 100:+.1f}%" if trend['change_pct'] is not None else 'n/a'
+                lines.append(f"- {METRIC_LABELS[trend['metric']]}: last {trend['days']} days "
+                             f"{format_value(trend['metric'], trend['current'])} vs previous "
+                             f"{format_value(trend['metric'], trend['previous'])} ({change})")
+            if summary['top_entities']:
+                lines.append(f"- Largest by {METRIC_LABELS[DATASETS[name]['weight']]}:")
+                for entity in summary['top_entities']:
+                    metrics = ', '.join(f"{METRIC_LABELS[m]} {format_value(m, v)}"
+                                        for m, v in entity.items() if m != 'entity')
+                    lines.append(f"  - {entity['entity']}: {metrics}")
+            lines.append('')
+
+    findings = top_findings(anomalies, question=question, limit=limit)
+    if findings:
+        lines.append(f"Precomputed anomalies (top {len(findings)} of {anomalies.get('finding_count', len(findings))}, "
+                     f"ranked by significance and size):")
+        for finding in findings:
+            entity_col = datasets.get(finding['dataset'], {}).get('entity_column')
+            lines.append(f"- {describe_finding(finding, entity_col)}")
+    elif overview or question:
+        lines.append('Precomputed anomalies: none above the thresholds.')
+    return '\n'.join(lines)
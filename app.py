@@ -1,69 +1,142 @@
-from flask import Flask, request, jsonify, render_template, session
+import time
+_import_started = time.perf_counter()
+
+from flask import Blueprint, Flask, request, jsonify, render_template, session, Response, stream_with_context
 from flask_cors import CORS
-import pandas as pd
-import json
 import os
-import numpy as np
 from datetime import datetime, timedelta
-import anthropic
 from werkzeug.utils import secure_filename
 import io
 from dotenv import load_dotenv
 import hashlib
 import pickle
 import traceback
+import threading
+from collections import OrderedDict
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-# Load environment variables
+# Load environment variables before the local modules read their configuration
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
-app.permanent_session_lifetime = timedelta(hours=2)
-CORS(app)
+# pandas, numpy and anthropic are imported on first use
+from lazy_imports import pd, np, anthropic, IMPORT_TIMINGS
+from model_router import route_request, MODEL_TIERS, FAST_TIER
+from reports import (
+    REPORT_TEMPLATES, REPORT_CONCURRENCY, resolve_questions, run_report,
+    new_report_id, save_report, load_report, assemble_report
+)
+from row_query import QueryError, parse_query, run_query, evict_session
+from retrieval import build_index, build_relevant_context
+from resilience import CallCancelled, CircuitOpenError, Deadline, DeadlineExceeded, ResilientCaller
+from prefetch import PREFETCH_ENABLED, PREFETCH_ANALYSIS_TYPES, Prefetcher
+from serialization import FastJSONProvider, compress_response, dumps_str, loads
+from kpi_engine import LOCAL_KPI_ENABLED, answer_kpi_question
+from anomalies import build_anomaly_context, describe_finding, detect_anomalies, has_overview
+
+bp = Blueprint('analyzer', __name__)
 
 # Configuration
 UPLOAD_FOLDER = 'uploads'
 SESSION_DATA_FOLDER = 'session_data'
 ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'xls'}
+FRAME_CACHE_SIZE = int(os.getenv('FRAME_CACHE_SIZE', '8'))  # sessions kept in memory for /rows
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
+CLAUDE_DEADLINE_SECONDS = float(os.getenv('CLAUDE_DEADLINE_SECONDS', '90'))  # per-request budget for Claude
+CLAUDE_TEST_DEADLINE_SECONDS = 15
+CLAUDE_MAX_RETRIES = int(os.getenv('CLAUDE_MAX_RETRIES', '1'))
 
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+# Startup timings in milliseconds, reported on /debug-config
+STARTUP_TIMINGS = {}
 
-# Ensure directories exist
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(SESSION_DATA_FOLDER, exist_ok=True)
+def create_app():
+    """Application factory - builds the Flask app without touching pandas or the Claude client"""
+    start = time.perf_counter()
+    
+    app = Flask(__name__)
+    app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-change-this')
+    app.permanent_session_lifetime = timedelta(hours=2)
+    CORS(app)
+    
+    app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+    app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
+    
+    # orjson for every jsonify() call, gzip for clients that accept it
+    app.json = FastJSONProvider(app)
+    
+    @app.after_request
+    def compress(response):
+        return compress_response(response, request.headers.get('Accept-Encoding'))
+    
+    # Ensure directories exist
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    os.makedirs(SESSION_DATA_FOLDER, exist_ok=True)
+    
+    app.register_blueprint(bp)
+    
+    STARTUP_TIMINGS['create_app_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"⏱️ App created in {STARTUP_TIMINGS['create_app_ms']} ms")
+    return app
 
-# Initialize Anthropic client with proper error handling
-try:
-    api_key = os.getenv('ANTHROPIC_API_KEY')
-    if not api_key or api_key == 'your-api-key-here':
-        print("WARNING: ANTHROPIC_API_KEY not found in environment variables!")
-        print("Please set your API key in the .env file")
-        client = None
-    else:
-        # Check if we're in a corporate environment with SSL issues
-        import ssl
-        import urllib3
+# Anthropic client, built on first use and shared by all request threads
+_client = None
+_client_lock = threading.Lock()
+_client_attempted = False
+
+def get_client():
+    """Return the shared Anthropic client, creating it on first use (None if not configured)"""
+    global _client, _client_attempted
+    if _client_attempted:
+        return _client
+    
+    with _client_lock:
+        if _client_attempted:
+            return _client
         
-        # For corporate networks with SSL inspection, we may need to handle certificates differently
+        # Initialize Anthropic client with proper error handling
         try:
-            # Try normal connection first
-            client = anthropic.Anthropic(
-                api_key=api_key,
-                timeout=60.0,
-                max_retries=3
-            )
-            print(f"Anthropic client initialized successfully with key: {api_key[:10]}...")
-        except Exception as ssl_error:
-            print(f"SSL/Connection issue detected: {ssl_error}")
-            print("This appears to be a corporate network with SSL inspection.")
-            print("Please try connecting via mobile hotspot or personal VPN.")
-            client = None
-            
-except Exception as e:
-    print(f"Error initializing Anthropic client: {e}")
-    client = None
+            api_key = os.getenv('ANTHROPIC_API_KEY')
+            if not api_key or api_key == 'your-api-key-here':
+                print("WARNING: ANTHROPIC_API_KEY not found in environment variables!")
+                print("Please set your API key in the .env file")
+            else:
+                # For corporate networks with SSL inspection, we may need to handle certificates differently
+                try:
+                    start = time.perf_counter()
+                    _client = anthropic.Anthropic(
+                        api_key=api_key,
+                        timeout=CLAUDE_DEADLINE_SECONDS,
+                        # Deadlines and hedging replace most SDK retries
+                        max_retries=CLAUDE_MAX_RETRIES
+                    )
+                    STARTUP_TIMINGS['client_init_ms'] = round((time.perf_counter() - start) * 1000, 1)
+                    print(f"Anthropic client initialized successfully with key: {api_key[:10]}...")
+                except Exception as ssl_error:
+                    print(f"SSL/Connection issue detected: {ssl_error}")
+                    print("This appears to be a corporate network with SSL inspection.")
+                    print("Please try connecting via mobile hotspot or personal VPN.")
+                    _client = None
+        except Exception as e:
+            print(f"Error initializing Anthropic client: {e}")
+            _client = None
+        
+        _client_attempted = True
+        return _client
+
+def warmup():
+    """Import the heavy libraries up front.
+    
+    Called from the gunicorn master when running with --preload so that forked
+    workers share the imported modules copy-on-write instead of each importing
+    them on their first request. The client itself is still built after fork.
+    """
+    start = time.perf_counter()
+    for module in (np, pd, anthropic):
+        module.load()
+    # Touch the parsers used on upload so their submodules are imported too
+    pd.read_csv(io.StringIO("a,b\n1,2"))
+    STARTUP_TIMINGS['warmup_ms'] = round((time.perf_counter() - start) * 1000, 1)
+    print(f"🔥 Warmup finished in {STARTUP_TIMINGS['warmup_ms']} ms")
+    return STARTUP_TIMINGS
 
 def get_session_id():
     """Get or create a session ID"""
@@ -108,11 +181,256 @@ def clear_session_data(session_id):
         if os.path.exists(filepath):
             os.remove(filepath)
             print(f"✅ Session data file deleted: {filepath}")
+        if os.path.exists(frames_path(session_id)):
+            os.remove(frames_path(session_id))
+        evict_session_frames(session_id)
+        prefetcher.cancel(session_id)
         return True
     except Exception as e:
         print(f"❌ Error clearing session data: {e}")
         return False
 
+def _is_upstream_failure(error):
+    """Errors that mean the Claude API is unhealthy (and count towards the circuit breaker)"""
+    if isinstance(error, (anthropic.APIConnectionError, DeadlineExceeded)):
+        return True
+    status_code = getattr(error, 'status_code', None)
+    return status_code is not None and (status_code >= 500 or status_code == 429)
+
+def _is_timeout(error):
+    return isinstance(error, anthropic.APITimeoutError)
+
+# Shared by all request threads: one circuit breaker and latency history per process
+claude_caller = ResilientCaller(_is_upstream_failure, is_timeout=_is_timeout)
+
+# Background analyses started after upload; finished results are shared with
+# the other workers through files next to the session data
+prefetcher = Prefetcher(results_folder=SESSION_DATA_FOLDER)
+
+def request_deadline(default_seconds=CLAUDE_DEADLINE_SECONDS):
+    """Deadline for the current request, optionally shortened by an X-Request-Deadline header (seconds)"""
+    try:
+        requested = float(request.headers.get('X-Request-Deadline', ''))
+    except ValueError:
+        requested = 0
+    if 0 < requested < default_seconds:
+        return Deadline(requested, client_set=True)
+    return Deadline(default_seconds)
+
+def call_claude(content, route, max_tokens=None, temperature=0.1, deadline=None):
+    """Send a single-turn prompt to the routed model and return the response text"""
+    if max_tokens:
+        route['max_tokens'] = max_tokens
+    deadline = deadline or Deadline(CLAUDE_DEADLINE_SECONDS)
+    client = get_client()
+    
+    def send(timeout):
+        request_args = dict(
+            model=route['model'],
+            max_tokens=route['max_tokens'],
+            temperature=temperature,
+            messages=[
+                {
+                    "role": "user",
+                    "content": content
+                }
+            ],
+            timeout=timeout
+        )
+        if not deadline.cancellable:
+            return client.messages.create(**request_args).content[0].text
+        
+        # Streamed, so cancelling (e.g. a superseded prefetch) drops the
+        # connection and stops generation instead of waiting for the full answer
+        stream = client.messages.create(stream=True, **request_args)
+        text = []
+        try:
+            for event in stream:
+                if deadline.cancelled():
+                    raise CallCancelled('Claude call cancelled')
+                if event.type == 'content_block_delta' and event.delta.type == 'text_delta':
+                    text.append(event.delta.text)
+        finally:
+            stream.close()
+        return ''.join(text)
+    
+    start = time.perf_counter()
+    text = claude_caller.call(route['model'], send, deadline)
+    route['latency_ms'] = round((time.perf_counter() - start) * 1000)
+    print(f"🧭 Routed to {route['model']} ({route['tier']}: {route['reason']}) in {route['latency_ms']} ms")
+    return text
+
+def circuit_open_response(error):
+    """503 returned immediately while the circuit breaker is open"""
+    response = jsonify({
+        'error': str(error),
+        'status': 'circuit_open',
+        'retry_after_seconds': error.retry_after,
+        'claude_health': claude_caller.health()
+    })
+    response.headers['Retry-After'] = str(int(error.retry_after) + 1)
+    return response, 503
+
+def deadline_exceeded_response(error):
+    return jsonify({
+        'error': f'{error}. Please try again in a moment.',
+        'status': 'deadline_exceeded'
+    }), 504
+
+def build_dataset_context(meta_df, sales_df, question=None, row_index=None, anomalies=None):
+    """Dataset description used as the prefix of every question prompt.
+    
+    When a retrieval index is available, each dataset shows the rows and
+    aggregates matching the question; otherwise it shows the first 5 rows.
+    The top precomputed anomalies follow, when the session has them.
+    """
+    relevant = build_relevant_context(question, {'meta': meta_df, 'sales': sales_df}, row_index) if question else {}
+    anomaly_context = build_anomaly_context(anomalies, question=question)
+    
+    def data_lines(name, df):
+        if name in relevant:
+            return '\n'.join(relevant[name])
+        sample = df.head(5).to_dict('records') if len(df) > 5 else df.to_dict('records')
+        return f"- Sample data (first 5 rows): {dumps_str(sample)}"
+    
+    def anomaly_section(text):
+        return f"\n3. {text}\n" if text else ''
+    
+    return f"""You are a data analyst expert specializing in META Ads and Sales performance analysis. 
+
+I have two datasets to analyze:
+
+1. META Ads Data:
+- {len(meta_df)} rows, {len(meta_df.columns)} columns
+- Columns: {', '.join(meta_df.columns)}
+{data_lines('meta', meta_df)}
+
+2. Sales Data:
+- {len(sales_df)} rows, {len(sales_df.columns)} columns  
+- Columns: {', '.join(sales_df.columns)}
+{data_lines('sales', sales_df)}
+{anomaly_section(anomaly_context)}"""
+
+def build_question_prompt(dataset_context, question):
+    """Append a question and the answering instructions to the dataset context"""
+    return f"""{dataset_context}
+Question: {question}
+
+Please provide a comprehensive analysis based on the question asked. When analyzing:
+1. Look for patterns, correlations, and insights in the data
+2. Provide specific numbers and metrics when possible
+3. Give actionable recommendations
+4. If you need to see more specific data points to answer accurately, let me know what additional information would be helpful
+5. Format your response clearly with key insights highlighted
+
+Answer the question thoroughly and provide valuable business insights."""
+
+def answer_locally(meta_df, sales_df, question, row_index=None):
+    """Exact answer for a standard KPI question computed with pandas, or None"""
+    if not LOCAL_KPI_ENABLED:
+        return None
+    try:
+        result = answer_kpi_question(question, meta_df, sales_df, row_index=row_index)
+    except Exception as e:
+        # Never fail the request over the shortcut; Claude can still answer
+        print(f"⚠️ Local KPI answer failed, falling back to Claude: {e}")
+        return None
+    if result is not None:
+        print(f"🧮 Answered locally: {result['kpi']}")
+        result['served_by'] = 'local_kpi'
+    return result
+
+def answer_question(meta_df, sales_df, question, row_index=None, anomalies=None, tier_override=None, deadline=None):
+    """Select the relevant data, then route and answer a single question"""
+    dataset_context = build_dataset_context(meta_df, sales_df, question=question, row_index=row_index, anomalies=anomalies)
+    context = build_question_prompt(dataset_context, question)
+    route = route_request(
+        question=question,
+        context_chars=len(context),
+        tier_override=tier_override
+    )
+    return {
+        'answer': call_claude(context, route, deadline=deadline),
+        'routing': route,
+        'served_by': 'claude'
+    }
+
+def load_session_frames(session_id, session_data):
+    """Return the META Ads and Sales DataFrames for a session.
+    
+    Served from the typed frames stored at upload (cached in memory), so
+    requests don't re-parse the JSON records; older sessions fall back to it.
+    """
+    frames, _ = get_session_frames(session_id)
+    if frames is not None:
+        return frames['meta'], frames['sales']
+    meta_df = pd.read_json(io.StringIO(session_data['meta_data']), orient='records')
+    sales_df = pd.read_json(io.StringIO(session_data['sales_data']), orient='records')
+    return meta_df, sales_df
+
+def load_session_index(session_id, session_data):
+    """Retrieval index for a session, stored with the frames (older sessions kept it in the session file)"""
+    frames, _ = get_session_frames(session_id)
+    if frames is not None and 'row_index' in frames:
+        return frames['row_index']
+    return session_data.get('row_index')
+
+# session_id -> (frames file mtime, {'meta': DataFrame, 'sales': DataFrame, 'row_index': dict})
+_frame_cache = OrderedDict()
+_frame_cache_lock = threading.Lock()
+
+def frames_path(session_id):
+    return os.path.join(SESSION_DATA_FOLDER, f"{session_id}_frames.pkl")
+
+def save_session_frames(session_id, frames):
+    """Store the parsed DataFrames with their original dtypes for row browsing"""
+    try:
+        with open(frames_path(session_id), 'wb') as f:
+            pickle.dump(frames, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return True
+    except Exception as e:
+        print(f"❌ Error saving session frames: {e}")
+        return False
+
+def get_session_frames(session_id):
+    """Return (frames, version) for a session, served from memory while the upload is unchanged"""
+    filepath = frames_path(session_id)
+    if not os.path.exists(filepath):
+        return None, None
+    version = str(os.stat(filepath).st_mtime_ns)
+    
+    with _frame_cache_lock:
+        cached = _frame_cache.get(session_id)
+        if cached and cached[0] == version:
+            _frame_cache.move_to_end(session_id)
+            return cached[1], version
+    
+    with open(filepath, 'rb') as f:
+        frames = pickle.load(f)
+    
+    with _frame_cache_lock:
+        _frame_cache[session_id] = (version, frames)
+        _frame_cache.move_to_end(session_id)
+        while len(_frame_cache) > FRAME_CACHE_SIZE:
+            _frame_cache.popitem(last=False)
+    return frames, version
+
+def evict_session_frames(session_id):
+    with _frame_cache_lock:
+        _frame_cache.pop(session_id, None)
+    evict_session(session_id)
+
+def precompute_anomalies(meta_df, sales_df):
+    """Run anomaly detection for a new upload; None if it fails, so the upload still succeeds"""
+    try:
+        anomalies = detect_anomalies(meta_df, sales_df)
+        print(f"📈 Found {anomalies['finding_count']} anomalies in {anomalies['elapsed_ms']} ms")
+        return anomalies
+    except Exception as e:
+        print(f"⚠️ Anomaly detection failed: {e}")
+        traceback.print_exc()
+        return None
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -155,11 +473,11 @@ def parse_uploaded_file(file):
     except Exception as e:
         return None, f"Error parsing file: {str(e)}"
 
-@app.route('/')
+@bp.route('/')
 def index():
     return render_template('index.html')
 
-@app.route('/upload', methods=['POST'])
+@bp.route('/upload', methods=['POST'])
 def upload_files():
     try:
         print("=== UPLOAD ENDPOINT DEBUG (FILE-BASED) ===")
@@ -215,11 +533,26 @@ def upload_files():
             'sales_data': sales_df_clean.to_json(orient='records'),
             'meta_columns': list(meta_df.columns),
             'sales_columns': list(sales_df.columns),
-            'upload_timestamp': datetime.now().isoformat()
+            'upload_timestamp': datetime.now().isoformat(),
+            # Ranked anomalies and trends, so prompts carry findings instead of raw rows
+            'anomalies': precompute_anomalies(meta_df, sales_df)
         }
         
         print(f"💾 Attempting to save data for session: {session_id}")
         
+        # A new upload supersedes any analyses prefetched for the previous one
+        prefetcher.cancel(session_id)
+        
+        # Keep typed DataFrames for /rows so pages never re-parse the JSON, plus the
+        # retrieval index (entity values -> row positions and date ranges), which
+        # grows with the data and so stays out of the session file
+        evict_session_frames(session_id)
+        save_session_frames(session_id, {
+            'meta': meta_df.reset_index(drop=True),
+            'sales': sales_df.reset_index(drop=True),
+            'row_index': build_index(meta_df, sales_df)
+        })
+        
         if save_session_data(session_id, session_data):
             print("✅ Data stored in FILE successfully (not session cookie)")
             print(f"📊 META data length: {len(session_data['meta_data'])} chars")
@@ -233,6 +566,19 @@ def upload_files():
         else:
             return jsonify({'error': 'Failed to save session data'}), 500
         
+        # Opt-in: start the standard analyses now so the first click is instant
+        prefetching = []
+        if PREFETCH_ENABLED and get_client() is not None:
+            prefetching = prefetcher.schedule(
+                session_id,
+                session_data['upload_timestamp'],
+                PREFETCH_ANALYSIS_TYPES,
+                lambda analysis_type, cancel_event: run_detailed_analysis(
+                    session_id, session_data, analysis_type,
+                    deadline=Deadline(CLAUDE_DEADLINE_SECONDS, cancel_event=cancel_event)
+                )
+            )
+        
         # Generate data summary for initial analysis
         meta_summary = {
             'rows': len(meta_df),
@@ -254,6 +600,7 @@ def upload_files():
             'message': 'Files uploaded successfully',
             'meta_summary': meta_summary,
             'sales_summary': sales_summary,
+            'prefetching': prefetching,
             'session_id': session_id  # Include session ID in response for debugging
         })
         
@@ -263,8 +610,10 @@ def upload_files():
         traceback.print_exc()
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
 
-@app.route('/ask', methods=['POST'])
+@bp.route('/ask', methods=['POST'])
 def ask_question():
+    # The whole request, including loading data, shares one time budget
+    deadline = request_deadline()
     try:
         print("=== ASK ENDPOINT DEBUG (FILE-BASED) ===")
         print(f"🔍 Ask endpoint called")
@@ -291,10 +640,6 @@ def ask_question():
         print(f"✅ Session data loaded successfully")
         print(f"📊 Session data keys: {list(session_data.keys())}")
         
-        # Check if Claude client is available
-        if client is None:
-            return jsonify({'error': 'Claude API not configured. Please check your ANTHROPIC_API_KEY in .env file'}), 500
-        
         data = request.get_json()
         question = data.get('question', '').strip()
         
@@ -317,66 +662,56 @@ def ask_question():
         # Reconstruct DataFrames from session data
         print("🔄 Reconstructing DataFrames...")
         try:
-            meta_df = pd.read_json(session_data['meta_data'], orient='records')
-            sales_df = pd.read_json(session_data['sales_data'], orient='records')
+            meta_df, sales_df = load_session_frames(session_id, session_data)
             print(f"✅ Data loaded successfully - META: {len(meta_df)} rows, Sales: {len(sales_df)} rows")
         except Exception as e:
             print(f"❌ Error reconstructing DataFrames: {e}")
             return jsonify({'error': 'Error reading uploaded data. Please re-upload your files.'}), 400
         
-        # Prepare context for Claude (limit data size for API)
-        meta_sample = meta_df.head(5).to_dict('records') if len(meta_df) > 5 else meta_df.to_dict('records')
-        sales_sample = sales_df.head(5).to_dict('records') if len(sales_df) > 5 else sales_df.to_dict('records')
+        row_index = load_session_index(session_id, session_data)
         
-        context = f"""You are a data analyst expert specializing in META Ads and Sales performance analysis. 
-
-I have two datasets to analyze:
-
-1. META Ads Data:
-- {len(meta_df)} rows, {len(meta_df.columns)} columns
-- Columns: {', '.join(meta_df.columns)}
-- Sample data (first 5 rows): {json.dumps(meta_sample, default=str)}
-
-2. Sales Data:
-- {len(sales_df)} rows, {len(sales_df.columns)} columns  
-- Columns: {', '.join(sales_df.columns)}
-- Sample data (first 5 rows): {json.dumps(sales_sample, default=str)}
-
-Question: {question}
-
-Please provide a comprehensive analysis based on the question asked. When analyzing:
-1. Look for patterns, correlations, and insights in the data
-2. Provide specific numbers and metrics when possible
-3. Give actionable recommendations
-4. If you need to see more specific data points to answer accurately, let me know what additional information would be helpful
-5. Format your response clearly with key insights highlighted
-
-Answer the question thoroughly and provide valuable business insights."""
+        # Standard KPI lookups are computed exactly over all rows, without Claude
+        local = answer_locally(meta_df, sales_df, question, row_index=row_index)
+        if local is not None:
+            return jsonify({
+                'answer': local['answer'],
+                'kpi': local['kpi'],
+                'result': local['result'],
+                'scope': local['scope'],
+                'served_by': local['served_by'],
+                'timestamp': datetime.now().isoformat()
+            })
+        
+        # Check if Claude client is available
+        if get_client() is None:
+            return jsonify({'error': 'Claude API not configured. Please check your ANTHROPIC_API_KEY in .env file'}), 500
         
         print("🤖 Sending request to Claude API...")
         
-        # Call Claude API with enhanced analysis capabilities
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",  # Use the correct model name
-            max_tokens=4000,
-            temperature=0.1,
-            messages=[
-                {
-                    "role": "user",
-                    "content": context
-                }
-            ]
+        # Context holds only the rows relevant to the question (limit data size for API)
+        result = answer_question(
+            meta_df, sales_df, question,
+            row_index=row_index,
+            anomalies=session_data.get('anomalies'),
+            tier_override=data.get('model_tier'),
+            deadline=deadline
         )
         
         print("✅ Claude API response received")
         
-        response_text = message.content[0].text
-        
         return jsonify({
-            'answer': response_text,
+            'answer': result['answer'],
+            'routing': result['routing'],
+            'served_by': result['served_by'],
             'timestamp': datetime.now().isoformat()
         })
         
+    except CircuitOpenError as e:
+        print(f"Claude circuit open: {e}")
+        return circuit_open_response(e)
+    except DeadlineExceeded as e:
+        print(f"Claude deadline exceeded: {e}")
+        return deadline_exceeded_response(e)
     except anthropic.APIError as e:
         print(f"Anthropic API Error: {e}")
         return jsonify({'error': f'Claude API Error: {str(e)}'}), 500
@@ -392,9 +727,99 @@ Answer the question thoroughly and provide valuable business insights."""
         traceback.print_exc()
         return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
-@app.route('/detailed-analysis', methods=['POST'])
+def run_detailed_analysis(session_id, session_data, analysis_type, tier_override=None, deadline=None):
+    """Build the prompt for an analysis type and run it through Claude"""
+    # Reconstruct DataFrames
+    meta_df, sales_df = load_session_frames(session_id, session_data)
+    
+    anomalies = session_data.get('anomalies')
+    
+    # Provide more detailed data context for specific analysis types
+    if analysis_type == 'performance_summary' and has_overview(anomalies):
+        # Totals, trends and anomalies precomputed over every row stand in for the raw data
+        context = f"""
+        Perform a comprehensive performance analysis of this META Ads and Sales data:
+        
+        META Ads Data Summary:
+        - Total rows: {len(meta_df)}
+        - Columns: {', '.join(meta_df.columns)}
+        - Sample (first 5 rows): {dumps_str(meta_df.head(5))}
+        
+        Sales Data Summary:
+        - Total rows: {len(sales_df)}
+        - Columns: {', '.join(sales_df.columns)}
+        - Sample (first 5 rows): {dumps_str(sales_df.head(5))}
+        
+        {build_anomaly_context(anomalies, overview=True)}
+        
+        Please provide:
+        1. Overall performance metrics and KPIs
+        2. Top performing campaigns/products
+        3. Key insights and patterns
+        4. Recommendations for optimization
+        5. Any concerning trends or opportunities, starting from the precomputed anomalies
+        """
+    elif analysis_type == 'performance_summary':
+        # No precomputed overview (older session, or no date column): full datasets, reusing the upload JSON
+        context = f"""
+        Perform a comprehensive performance analysis of this META Ads and Sales data:
+        
+        META Ads Data Summary:
+        - Total rows: {len(meta_df)}
+        - Columns: {', '.join(meta_df.columns)}
+        - Full dataset: {session_data['meta_data']}
+        
+        Sales Data Summary:
+        - Total rows: {len(sales_df)}
+        - Columns: {', '.join(sales_df.columns)}
+        - Full dataset: {session_data['sales_data']}
+        
+        Please provide:
+        1. Overall performance metrics and KPIs
+        2. Top performing campaigns/products
+        3. Key insights and patterns
+        4. Recommendations for optimization
+        5. Any concerning trends or opportunities
+        """
+    else:
+        # Standard analysis with sample data
+        context = f"""
+        Analyze this META Ads and Sales data:
+        
+        META Ads Data ({len(meta_df)} rows):
+        Columns: {', '.join(meta_df.columns)}
+        Sample: {dumps_str(meta_df.head(5))}
+        
+        Sales Data ({len(sales_df)} rows):
+        Columns: {', '.join(sales_df.columns)}
+        Sample: {dumps_str(sales_df.head(5))}
+        
+        {build_anomaly_context(anomalies)}
+        
+        Provide a general business intelligence analysis with key insights.
+        """
+    
+    route = route_request(
+        analysis_type=analysis_type,
+        context_chars=len(context),
+        tier_override=tier_override
+    )
+    
+    # Call Claude API
+    response_text = call_claude(context, route, deadline=deadline)
+    
+    return {
+        'analysis': response_text,
+        'analysis_type': analysis_type,
+        'routing': route,
+        'served_by': 'claude',
+        'timestamp': datetime.now().isoformat()
+    }
+
+@bp.route('/detailed-analysis', methods=['POST'])
 def detailed_analysis():
     """Get detailed analysis of specific data subsets"""
+    deadline = request_deadline()
     try:
         data = request.get_json()
         analysis_type = data.get('analysis_type', 'general')
@@ -408,73 +833,118 @@ def detailed_analysis():
         if not session_data or 'meta_data' not in session_data or 'sales_data' not in session_data:
             return jsonify({'error': 'Please upload files first'}), 400
         
-        # Reconstruct DataFrames
-        meta_df = pd.read_json(session_data['meta_data'], orient='records')
-        sales_df = pd.read_json(session_data['sales_data'], orient='records')
+        upload_version = session_data.get('upload_timestamp')
+        tier_override = data.get('model_tier')
         
-        # Provide more detailed data context for specific analysis types
-        if analysis_type == 'performance_summary':
-            context = f"""
-            Perform a comprehensive performance analysis of this META Ads and Sales data:
-            
-            META Ads Data Summary:
-            - Total rows: {len(meta_df)}
-            - Columns: {', '.join(meta_df.columns)}
-            - Full dataset: {meta_df.to_json(orient='records')}
-            
-            Sales Data Summary:
-            - Total rows: {len(sales_df)}
-            - Columns: {', '.join(sales_df.columns)}
-            - Full dataset: {sales_df.to_json(orient='records')}
-            
-            Please provide:
-            1. Overall performance metrics and KPIs
-            2. Top performing campaigns/products
-            3. Key insights and patterns
-            4. Recommendations for optimization
-            5. Any concerning trends or opportunities
-            """
-        else:
-            # Standard analysis with sample data
-            context = f"""
-            Analyze this META Ads and Sales data:
-            
-            META Ads Data ({len(meta_df)} rows):
-            Columns: {', '.join(meta_df.columns)}
-            Sample: {meta_df.head(5).to_json(orient='records')}
-            
-            Sales Data ({len(sales_df)} rows):
-            Columns: {', '.join(sales_df.columns)}
-            Sample: {sales_df.head(5).to_json(orient='records')}
-            
-            Provide a general business intelligence analysis with key insights.
-            """
-        
-        # Call Claude API
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
-            max_tokens=4000,
-            temperature=0.1,
-            messages=[
-                {
-                    "role": "user",
-                    "content": context
-                }
-            ]
-        )
+        # Reuse a prefetched result for this upload, or attach to the one in flight
+        future = prefetcher.lookup(session_id, upload_version, analysis_type) if not tier_override else None
+        if future is not None:
+            try:
+                result = future.result(timeout=deadline.remaining())
+                print(f"🔮 Served {analysis_type} from prefetch")
+                return jsonify({**result, 'prefetched': True})
+            except FutureTimeoutError:
+                return deadline_exceeded_response(DeadlineExceeded('Prefetched analysis did not finish in time'))
+            except Exception as e:
+                # Cancelled or failed prefetch - run the analysis now instead
+                print(f"Prefetch for {analysis_type} unusable ({type(e).__name__}), running it now")
+        
+        result = run_detailed_analysis(session_id, session_data, analysis_type,
+                                       tier_override=tier_override, deadline=deadline)
+        return jsonify({**result, 'prefetched': False})
+        
+    except CircuitOpenError as e:
+        return circuit_open_response(e)
+    except DeadlineExceeded as e:
+        return deadline_exceeded_response(e)
+    except Exception as e:
+        return jsonify({'error': f'Detailed analysis failed: {str(e)}'}), 500
+
+@bp.route('/report', methods=['POST'])
+def generate_report():
+    """Answer a batch of questions (or a named template) concurrently for the current session"""
+    try:
+        if 'session_id' not in session:
+            return jsonify({'error': 'No session found. Please upload files first'}), 400
         
-        response_text = message.content[0].text
+        session_id = session['session_id']
+        session_data = load_session_data(session_id)
         
-        return jsonify({
-            'analysis': response_text,
-            'analysis_type': analysis_type,
-            'timestamp': datetime.now().isoformat()
-        })
+        if not session_data or 'meta_data' not in session_data or 'sales_data' not in session_data:
+            return jsonify({'error': 'Session data not found. Please upload files first'}), 400
+        
+        data = request.get_json() or {}
+        questions, template, error = resolve_questions(data)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        tier_override = data.get('model_tier')
+        stream = data.get('stream', True)
+        
+        # Load the datasets and retrieval index once for every question
+        meta_df, sales_df = load_session_frames(session_id, session_data)
+        row_index = load_session_index(session_id, session_data)
+        anomalies = session_data.get('anomalies')
+        
+        def answer_fn(question):
+            local = answer_locally(meta_df, sales_df, question, row_index=row_index)
+            if local is not None:
+                return local
+            # Only questions that need Claude fail without it; local answers still come back
+            if get_client() is None:
+                raise RuntimeError('Claude API not configured. Please check your ANTHROPIC_API_KEY in .env file')
+            return answer_question(meta_df, sales_df, question, row_index=row_index, anomalies=anomalies,
+                                   tier_override=tier_override)
+        
+        report_id = new_report_id()
+        started_at = datetime.now()
+        print(f"📑 Report {report_id}: {len(questions)} questions, concurrency {REPORT_CONCURRENCY}")
+        
+        def finish(results):
+            report = assemble_report(report_id, session_id, template, questions, results, started_at)
+            save_report(report)
+            print(f"📑 Report {report_id} completed in {report['elapsed_ms']} ms")
+            return report
+        
+        if not stream:
+            report = finish(list(run_report(questions, answer_fn)))
+            return jsonify(report)
+        
+        def generate():
+            # Newline-delimited JSON: one event per line as each answer completes
+            yield dumps_str({'type': 'started', 'report_id': report_id, 'template': template,
+                             'question_count': len(questions)}) + '\n'
+            results = []
+            for result in run_report(questions, answer_fn):
+                results.append(result)
+                yield dumps_str({'type': 'result', **result}) + '\n'
+            report = finish(results)
+            yield dumps_str({'type': 'complete', 'report_id': report_id,
+                             'failed_count': report['failed_count'],
+                             'elapsed_ms': report['elapsed_ms']}) + '\n'
+        
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
         
     except Exception as e:
-        return jsonify({'error': f'Detailed analysis failed: {str(e)}'}), 500
+        print(f"General error in generate_report: {str(e)}")
+        traceback.print_exc()
+        return jsonify({'error': f'Report failed: {str(e)}'}), 500
+
+@bp.route('/report/<report_id>', methods=['GET'])
+def get_report(report_id):
+    """Fetch a persisted report belonging to the current session"""
+    report_bytes = load_report(report_id)
+    if report_bytes is None or loads(report_bytes).get('session_id') != session.get('session_id'):
+        return jsonify({'error': 'Report not found'}), 404
+    # Serve the stored JSON as-is instead of decoding and re-encoding it
+    return Response(report_bytes, mimetype='application/json')
 
-@app.route('/data-summary', methods=['GET'])
+@bp.route('/report-templates', methods=['GET'])
+def list_report_templates():
+    """List the named report templates and their questions"""
+    return jsonify(REPORT_TEMPLATES)
+
+@bp.route('/data-summary', methods=['GET'])
 def get_data_summary():
     try:
         if 'session_id' not in session:
@@ -487,8 +957,7 @@ def get_data_summary():
             return jsonify({'error': 'No data uploaded'}), 400
         
         # Reconstruct DataFrames
-        meta_df = pd.read_json(session_data['meta_data'], orient='records')
-        sales_df = pd.read_json(session_data['sales_data'], orient='records')
+        meta_df, sales_df = load_session_frames(session_id, session_data)
         
         summary = {
             'meta_ads': {
@@ -508,7 +977,61 @@ def get_data_summary():
     except Exception as e:
         return jsonify({'error': f'Failed to get summary: {str(e)}'}), 500
 
-@app.route('/session-status', methods=['GET'])
+@bp.route('/anomalies', methods=['GET'])
+def get_anomalies():
+    """Ranked anomalies and trends precomputed at upload"""
+    try:
+        if 'session_id' not in session:
+            return jsonify({'error': 'No data uploaded'}), 400
+        
+        session_data = load_session_data(session['session_id'])
+        
+        if not session_data or 'meta_data' not in session_data or 'sales_data' not in session_data:
+            return jsonify({'error': 'No data uploaded'}), 400
+        
+        anomalies = session_data.get('anomalies')
+        if anomalies is None:
+            return jsonify({'error': 'No anomalies computed for this upload. Please re-upload your files.'}), 404
+        
+        datasets = anomalies.get('datasets', {})
+        findings = [
+            {**finding, 'description': describe_finding(finding, datasets.get(finding['dataset'], {}).get('entity_column'))}
+            for finding in anomalies['findings']
+        ]
+        return jsonify({**anomalies, 'findings': findings})
+        
+    except Exception as e:
+        return jsonify({'error': f'Failed to get anomalies: {str(e)}'}), 500
+
+@bp.route('/rows', methods=['POST'])
+def query_rows():
+    """Browse dataset rows with column selection, filters, sorting and cursor pagination"""
+    try:
+        if 'session_id' not in session:
+            return jsonify({'error': 'No data uploaded'}), 400
+        
+        session_id = session['session_id']
+        start = time.perf_counter()
+        
+        # Only the typed frames are needed - the JSON session file is never read here
+        frames, version = get_session_frames(session_id)
+        if frames is None:
+            return jsonify({'error': 'No data uploaded. Please upload your files to browse rows'}), 400
+        
+        datasets = {'meta': frames['meta'], 'sales': frames['sales']}
+        query = parse_query(request.get_json() or {}, datasets)
+        page = run_query(session_id, version, datasets, query)
+        page['elapsed_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        
+        return jsonify(page)
+        
+    except QueryError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        traceback.print_exc()
+        return jsonify({'error': f'Row query failed: {str(e)}'}), 500
+
+@bp.route('/session-status', methods=['GET'])
 def session_status():
     """Check what's in the current session"""
     if 'session_id' not in session:
@@ -528,10 +1051,12 @@ def session_status():
         'has_sales_data': 'sales_data' in session_data,
         'meta_data_length': len(session_data.get('meta_data', '')) if 'meta_data' in session_data else 0,
         'sales_data_length': len(session_data.get('sales_data', '')) if 'sales_data' in session_data else 0,
-        'upload_timestamp': session_data.get('upload_timestamp', 'Not found')
+        'upload_timestamp': session_data.get('upload_timestamp', 'Not found'),
+        'prefetch_status': prefetcher.status(session_id),
+        'anomaly_count': (session_data.get('anomalies') or {}).get('finding_count')
     })
 
-@app.route('/clear-data', methods=['POST'])
+@bp.route('/clear-data', methods=['POST'])
 def clear_data():
     """Clear uploaded data from session"""
     try:
@@ -545,48 +1070,65 @@ def clear_data():
     except Exception as e:
         return jsonify({'error': f'Failed to clear data: {str(e)}'}), 500
 
-@app.route('/test-claude', methods=['GET'])
+@bp.route('/test-claude', methods=['GET'])
 def test_claude():
     """Test endpoint to verify Claude API is working"""
     try:
-        if client is None:
+        if get_client() is None:
             return jsonify({
                 'status': 'error',
                 'message': 'Claude client not initialized. Check ANTHROPIC_API_KEY in .env file'
             }), 500
         
-        # Simple test message
-        message = client.messages.create(
-            model="claude-3-5-sonnet-20241022",
+        # Simple test message - always served by the fast model
+        route = route_request(tier_override=FAST_TIER)
+        route['reason'] = 'connection test'
+        response_text = call_claude(
+            "Hello! Please respond with 'API connection successful!' to confirm you're working.",
+            route,
             max_tokens=50,
-            messages=[
-                {
-                    "role": "user",
-                    "content": "Hello! Please respond with 'API connection successful!' to confirm you're working."
-                }
-            ]
+            temperature=0,
+            deadline=request_deadline(CLAUDE_TEST_DEADLINE_SECONDS)
         )
         
-        response_text = message.content[0].text
-        
         return jsonify({
             'status': 'success',
             'message': 'Claude API is working!',
-            'response': response_text
+            'response': response_text,
+            'routing': route,
+            'claude_health': claude_caller.health()
         })
         
+    except CircuitOpenError as e:
+        return jsonify({
+            'status': 'circuit_open',
+            'message': str(e),
+            'suggestion': 'Claude API calls are failing fast after repeated errors. Wait for the retry window to pass',
+            'claude_health': claude_caller.health()
+        }), 503
+        
+    except DeadlineExceeded as e:
+        return jsonify({
+            'status': 'error',
+            'message': str(e),
+            'suggestion': 'The Claude API is responding slowly. Try again in a moment',
+            'claude_health': claude_caller.health()
+        }), 504
+        
     except anthropic.APIConnectionError as e:
         return jsonify({
             'status': 'error',
             'message': f'Connection error: {str(e)}',
-            'suggestion': 'Check your internet connection and firewall settings'
+            'suggestion': 'Check your internet connection and firewall settings',
+            'claude_health': claude_caller.health()
         }), 500
         
     except anthropic.APIError as e:
         return jsonify({
             'status': 'error',
             'message': f'API error: {str(e)}',
-            'suggestion': 'Check your API key is valid and has proper permissions'
+            'suggestion': 'Check your API key is valid and has proper permissions',
+            'claude_health': claude_caller.health()
         }), 500
         
     except Exception as e:
@@ -595,7 +1137,7 @@ def test_claude():
             'message': f'Unexpected error: {str(e)}'
         }), 500
 
-@app.route('/debug-config', methods=['GET'])
+@bp.route('/debug-config', methods=['GET'])
 def debug_config():
     """Debug endpoint to check configuration"""
     api_key = os.getenv('ANTHROPIC_API_KEY')
@@ -605,11 +1147,31 @@ def debug_config():
         'api_key_loaded': bool(api_key),
         'api_key_format': api_key[:15] + '...' if api_key and len(api_key) > 15 else 'Not found',
         'api_key_length': len(api_key) if api_key else 0,
-        'client_initialized': client is not None,
+        'client_initialized': _client is not None,
+        'startup_timings': STARTUP_TIMINGS,
+        'import_timings': IMPORT_TIMINGS,
+        'model_tiers': MODEL_TIERS,
+        'claude_health': claude_caller.health(),
         'working_directory': os.getcwd(),
         'session_data_folder_exists': os.path.exists(SESSION_DATA_FOLDER),
         'session_data_folder_path': os.path.abspath(SESSION_DATA_FOLDER)
     })
 
+STARTUP_TIMINGS['import_ms'] = round((time.perf_counter() - _import_started) * 1000, 1)
+print(f"⏱️ app.py imported in {STARTUP_TIMINGS['import_ms']} ms")
+
+_app = None
+
+def __getattr__(name):
+    # `gunicorn app:app` and `from app import app` still work, but the app is
+    # only built when something actually asks for it
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 if __name__ == '__main__':
+    app = create_app()
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,425 @@
+"""
+Deterministic answers for common KPI questions.
+
+Questions like "total spend", "revenue last 7 days", "CTR by campaign" or
+"best-selling product" are matched to a catalog of KPIs and computed exactly
+with vectorized pandas over the full session data, instead of asking Claude to
+estimate them from a handful of sample rows. Anything open-ended is left to
+Claude.
+"""
+
+import os
+import re
+
+from lazy_imports import pd, np
+from model_router import DEEP_KEYWORDS
+from retrieval import (
+    MONTHS, anchor_date, find_date_column, match_entities, normalize, parse_dates, parse_time_range,
+    strip_matched_names
+)
+
+LOCAL_KPI_ENABLED = os.getenv('LOCAL_KPI_ENABLED', 'true').lower() == 'true'
+TOP_N = 10
+
+# Column name patterns, tried in order; the first numeric (or name) column that matches wins
+COLUMN_PATTERNS = {
+    'spend': [r'amount spent', r'\bspend\b', r'\bspent\b', r'^cost$'],
+    'impressions': [r'^impressions$', r'impressions'],
+    'clicks': [r'link clicks', r'^clicks', r'clicks \(all\)', r'\bclicks\b'],
+    'purchase_value': [r'purchases? conversion value', r'conversion value', r'purchase value', r'revenue'],
+    'revenue': [r'total sales', r'net sales', r'gross sales', r'revenue', r'^total$', r'\bsales\b'],
+    'quantity': [r'net quantity', r'quantity', r'\bunits\b', r'\bqty\b'],
+    'orders': [r'order id', r'order name', r'^order$', r'^orders$'],
+    'campaign': [r'campaign name', r'campaign'],
+    'product': [r'product title', r'product name', r'lineitem name', r'^product$', r'product'],
+}
+
+# Never pick derived metrics when looking for a base metric
+EXCLUDE_PATTERN = re.compile(r'cost per|\bcpc\b|\bcpm\b|\bctr\b|\brate\b|per 1,?000|roas|average|avg', re.IGNORECASE)
+
+NUMERIC_ROLES = {'spend', 'impressions', 'clicks', 'purchase_value', 'revenue', 'quantity'}
+
+
+def find_column(df, role):
+    for pattern in COLUMN_PATTERNS[role]:
+        for col in df.columns:
+            name = str(col).lower()
+            if not re.search(pattern, name) or EXCLUDE_PATTERN.search(name):
+                continue
+            if role in NUMERIC_ROLES and numeric(df[col]).notna().sum() == 0:
+                continue
+            return col
+    return None
+
+
+def numeric(series):
+    """Numeric view of a column, tolerating currency symbols and thousands separators"""
+    if pd.api.types.is_numeric_dtype(series):
+        return series
+    cleaned = series.astype(str).str.replace(r'[^0-9.\-]', '', regex=True)
+    return pd.to_numeric(cleaned, errors='coerce')
+
+
+def fmt(value, decimals=2):
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return 'n/a'
+    return f"{value:,.{decimals}f}"
+
+
+def pct(value):
+    return 'n/a' if value is None or np.isnan(value) else f"{value * 100:.2f}%"
+
+
+def safe_ratio(numerator, denominator):
+    return float(numerator) / float(denominator) if denominator else float('nan')
+
+
+# Intent catalog: (name, dataset, pattern). Order matters - more specific first.
+INTENTS = [
+    ('ctr_by_campaign', 'meta', r'\b(ctr|click.?through rate)\b.*\b(by|per|each|every|which)\b.*campaign|campaigns?.*\b(ctr|click.?through rate)\b'),
+    ('roas_by_campaign', 'meta', r'\b(roas|return on ad spend)\b.*\b(by|per|each|every|which)\b.*campaign|campaigns?.*\b(roas|return on ad spend)\b'),
+    ('spend_by_campaign', 'meta', r'\b(spend|spent)\b.*\b(by|per|each|every)\b.*campaign|campaigns?.*\b(spent the most|most spend|highest spend|spend the most)\b'),
+    ('revenue_by_product', 'sales', r'\b(revenue|sales)\b.*\b(by|per|each|every)\b.*product|products?.*\b(most revenue|highest revenue|highest sales|by (revenue|sales))\b'),
+    ('best_selling_product', 'sales', r'\b(best|top).?sell(ing|er|ers)\b|\b(sold|sells) the most\b|\bmost (sold|popular) products?\b|\btop products?\b'),
+    ('roas', 'both', r'\b(roas|return on ad spend)\b'),
+    ('ctr', 'meta', r'\b(ctr|click.?through rate)\b'),
+    ('cpc', 'meta', r'\b(cpc|cost per click)\b'),
+    ('cpm', 'meta', r'\b(cpm|cost per (1 ?000|thousand|mille) impressions)\b'),
+    ('total_spend', 'meta', r'\b(ad ?spend|spend|spent)\b'),
+    ('total_impressions', 'meta', r'\bimpressions\b'),
+    ('total_clicks', 'meta', r'\bclicks\b'),
+    ('order_count', 'sales', r'\b(how many|number of|count of|total) orders\b'),
+    ('units_sold', 'sales', r'\b(units|items|quantity)\b.*\bsold\b|\bhow many (units|items)\b'),
+    ('total_revenue', 'sales', r'\b(revenue|sales|turnover)\b'),
+]
+
+# The question must read as a lookup, not a request for interpretation
+LOOKUP_PATTERN = re.compile(
+    r'\b(what|whats|how much|how many|total|overall|show|give|list|which|tell me|sum|'
+    r'best|top|by|per)\b'
+)
+OPEN_ENDED_PATTERN = re.compile(
+    r'\b(should|could|would|good|bad|efficient|healthy|worth|better|worse|enough|vs|versus|'
+    r'how (did|does|do|is|are|was|were)|is (it|this|that|our|my)|are (we|they|our|my))\b'
+)
+SHORT_QUESTION_WORDS = 4
+
+# Metric names that contain grouping words of their own
+METRIC_PHRASES = re.compile(
+    r'\bcost per (click|1 ?000 impressions|thousand impressions|mille)\b|\bclick ?through rate\b|\breturn on ad spend\b'
+)
+GROUPING_PATTERN = re.compile(r'\b(by|per|each|every|which|highest|lowest|most|least|top|best|worst|bottom)\b')
+# Rankings are computed best-first only
+REVERSED_RANKING_PATTERN = re.compile(r'\b(lowest|least|worst|bottom)\b')
+DIMENSION_PATTERN = re.compile(
+    r'\b(by|per|each|every|which|across)( (?!\d)\w+){0,3} (ad ?sets?|adsets?|ads|ad name|days?|weeks?|months?|'
+    r'dates?|hours?|orders?|skus?|variants?|placements?|devices?|countries|country|regions?|ages?|genders?|'
+    r'platforms?|channels?|customers?)\b|\b(daily|weekly|monthly|hourly)\b|'
+    r'\b(each|every|per|by)( of)?( the)? (last|past) \d+\b'
+)
+# Dimension each ranked intent groups by; the other intents are single totals
+INTENT_DIMENSIONS = {
+    'ctr_by_campaign': 'campaign',
+    'roas_by_campaign': 'campaign',
+    'spend_by_campaign': 'campaign',
+    'revenue_by_product': 'product',
+    'best_selling_product': 'product',
+}
+RATE_INTENTS = {'roas', 'ctr', 'cpc', 'cpm', 'ctr_by_campaign', 'roas_by_campaign'}
+
+# Every word a supported question may contain once matched entity names are removed.
+# Anything else is a filter or qualifier the engine can't apply, so Claude answers instead.
+KNOWN_WORDS = set("""
+    a an the of for in on at to from during across between and all our my we i me us you s t
+    what whats is was were are be been has have had did do does how much many show give list tell
+    sum total overall value amount number count so far current currently entire whole period
+    so far please which by per each every best top most highest selling seller sellers sell sells sold
+    popular generated made brought ad ads adspend spend spent spending impressions impression clicks click
+    link ctr through rate cpc cost costs cpm thousand mille roas return revenue revenues sales sale
+    turnover income orders order units unit items item quantity product products campaign campaigns
+    last past this previous prior days day weeks week months month years year yesterday today
+    ytd mtd black friday cyber monday bfcm weekend
+""".split()) | set(MONTHS)
+# Words that make a question time-bound; if no range is resolved from them the
+# totals would silently cover every row, so Claude answers instead
+TIME_WORDS_PATTERN = re.compile(
+    r'\b(\d+|yesterday|today|ytd|mtd|weekends?|days?|weeks?|months?|years?|black friday|cyber monday|bfcm|'
+    + '|'.join(sorted(MONTHS, key=len, reverse=True)) + r')\b'
+)
+
+
+def _unsupported_grouping(intent, text):
+    """True when the question asks for a breakdown or ranking the intent doesn't compute"""
+    text = METRIC_PHRASES.sub(' ', text)
+    if not GROUPING_PATTERN.search(text):
+        return False
+    if intent not in INTENT_DIMENSIONS:
+        return True
+    return bool(DIMENSION_PATTERN.search(text) or REVERSED_RANKING_PATTERN.search(text))
+
+
+def _unknown_words(intent, text):
+    allowed = KNOWN_WORDS | ({'average', 'avg'} if intent in RATE_INTENTS else set())
+    return [w for w in text.split() if w not in allowed and not w.isdigit()]
+
+
+def match_intent(question):
+    """Return the KPI intent for a lookup-style question, or None.
+
+    Pass the question with matched entity names already removed; any word the
+    catalog doesn't know, or a breakdown the intent doesn't compute, returns None.
+    """
+    text = normalize(question)
+    if DEEP_KEYWORDS.search(text) or OPEN_ENDED_PATTERN.search(text):
+        return None
+    if not LOOKUP_PATTERN.search(text) and len(text.split()) > SHORT_QUESTION_WORDS:
+        return None
+    for name, dataset, pattern in INTENTS:
+        if re.search(pattern, text):
+            if _unsupported_grouping(name, text) or _unknown_words(name, text):
+                return None
+            return name, dataset
+    return None
+
+
+def _scope(df, dataset_index, matches, time_range):
+    """Restrict a dataset to the entities and time range named in the question"""
+    description = []
+    mask = np.ones(len(df), dtype=bool)
+
+    if dataset_index:
+        for col, entries in matches.items():
+            entity_mask = np.zeros(len(df), dtype=bool)
+            for entry in entries:
+                entity_mask[entry['positions'][entry['positions'] < len(df)]] = True
+            mask &= entity_mask
+            description.append(f"{col}: {', '.join(str(e['value']) for e in entries[:5])}")
+
+    if time_range:
+        date_col = dataset_index['date_column'] if dataset_index else find_date_column(df)
+        if date_col is None or date_col not in df.columns:
+            return None, None
+        start, end, label = time_range
+        dates = parse_dates(df[date_col]).dt.date
+        mask &= ((dates >= start) & (dates <= end)).to_numpy()
+        description.append(f"{label}: {start.isoformat()} to {end.isoformat()}")
+
+    return df[mask] if not mask.all() else df, description
+
+
+def _require(df, *roles):
+    columns = {role: find_column(df, role) for role in roles}
+    return None if any(col is None for col in columns.values()) else columns
+
+
+def _ranked(series, value_label, decimals=2, as_pct=False):
+    rows = [{'name': str(name), value_label: (None if np.isnan(value) else round(float(value), 6))}
+            for name, value in series.items()]
+    lines = [f"{i}. {row['name']}: {pct(series.iloc[i - 1]) if as_pct else fmt(series.iloc[i - 1], decimals)}"
+             for i, row in enumerate(rows, 1)]
+    return rows, lines
+
+
+def compute(intent, meta_df, sales_df):
+    """Compute one KPI; returns (headline, result, detail_lines) or None if columns are missing"""
+    if intent == 'total_spend':
+        cols = _require(meta_df, 'spend')
+        if cols:
+            total = float(numeric(meta_df[cols['spend']]).sum())
+            return f"Total ad spend: {fmt(total)}", {'total_spend': total, 'column': cols['spend']}, []
+
+    if intent == 'total_impressions':
+        cols = _require(meta_df, 'impressions')
+        if cols:
+            total = float(numeric(meta_df[cols['impressions']]).sum())
+            return f"Total impressions: {fmt(total, 0)}", {'total_impressions': total}, []
+
+    if intent == 'total_clicks':
+        cols = _require(meta_df, 'clicks')
+        if cols:
+            total = float(numeric(meta_df[cols['clicks']]).sum())
+            return f"Total clicks ({cols['clicks']}): {fmt(total, 0)}", {'total_clicks': total}, []
+
+    if intent == 'ctr':
+        cols = _require(meta_df, 'clicks', 'impressions')
+        if cols:
+            clicks = numeric(meta_df[cols['clicks']]).sum()
+            impressions = numeric(meta_df[cols['impressions']]).sum()
+            ctr = safe_ratio(clicks, impressions)
+            return (f"CTR: {pct(ctr)} ({fmt(clicks, 0)} clicks / {fmt(impressions, 0)} impressions)",
+                    {'ctr': ctr, 'clicks': float(clicks), 'impressions': float(impressions)}, [])
+
+    if intent == 'cpc':
+        cols = _require(meta_df, 'spend', 'clicks')
+        if cols:
+            spend = numeric(meta_df[cols['spend']]).sum()
+            clicks = numeric(meta_df[cols['clicks']]).sum()
+            cpc = safe_ratio(spend, clicks)
+            return (f"Cost per click: {fmt(cpc)} ({fmt(spend)} spend / {fmt(clicks, 0)} clicks)",
+                    {'cpc': cpc, 'spend': float(spend), 'clicks': float(clicks)}, [])
+
+    if intent == 'cpm':
+        cols = _require(meta_df, 'spend', 'impressions')
+        if cols:
+            spend = numeric(meta_df[cols['spend']]).sum()
+            impressions = numeric(meta_df[cols['impressions']]).sum()
+            cpm = safe_ratio(spend * 1000, impressions)
+            return (f"CPM: {fmt(cpm)} ({fmt(spend)} spend / {fmt(impressions, 0)} impressions)",
+                    {'cpm': cpm, 'spend': float(spend), 'impressions': float(impressions)}, [])
+
+    if intent == 'roas':
+        spend_col = find_column(meta_df, 'spend')
+        if spend_col:
+            spend = numeric(meta_df[spend_col]).sum()
+            value_col = find_column(meta_df, 'purchase_value')
+            if value_col:
+                revenue, source = numeric(meta_df[value_col]).sum(), f"META {value_col}"
+            else:
+                revenue_col = find_column(sales_df, 'revenue')
+                if revenue_col is None:
+                    return None
+                revenue, source = numeric(sales_df[revenue_col]).sum(), f"Sales {revenue_col}"
+            roas = safe_ratio(revenue, spend)
+            return (f"ROAS: {fmt(roas)}x ({fmt(revenue)} revenue from {source} / {fmt(spend)} spend)",
+                    {'roas': roas, 'revenue': float(revenue), 'spend': float(spend), 'revenue_source': source}, [])
+
+    if intent == 'total_revenue':
+        cols = _require(sales_df, 'revenue')
+        if cols:
+            total = float(numeric(sales_df[cols['revenue']]).sum())
+            return f"Total revenue ({cols['revenue']}): {fmt(total)}", {'total_revenue': total, 'column': cols['revenue']}, []
+
+    if intent == 'units_sold':
+        cols = _require(sales_df, 'quantity')
+        if cols:
+            total = float(numeric(sales_df[cols['quantity']]).sum())
+            return f"Units sold: {fmt(total, 0)}", {'units_sold': total}, []
+
+    if intent == 'order_count':
+        # Sales exports are often one row per line item, so rows are not orders
+        col = find_column(sales_df, 'orders')
+        if col:
+            count = int(sales_df[col].nunique())
+            return f"Orders: {count:,} (distinct {col})", {'orders': count, 'column': col}, []
+
+    if intent == 'spend_by_campaign':
+        cols = _require(meta_df, 'campaign', 'spend')
+        if cols:
+            totals = (numeric(meta_df[cols['spend']]).groupby(meta_df[cols['campaign']]).sum()
+                      .sort_values(ascending=False).head(TOP_N))
+            rows, lines = _ranked(totals, 'spend')
+            return f"Spend by campaign (top {len(rows)}):", {'spend_by_campaign': rows}, lines
+
+    if intent == 'ctr_by_campaign':
+        cols = _require(meta_df, 'campaign', 'clicks', 'impressions')
+        if cols:
+            grouped = pd.DataFrame({
+                'clicks': numeric(meta_df[cols['clicks']]),
+                'impressions': numeric(meta_df[cols['impressions']]),
+            }).groupby(meta_df[cols['campaign']]).sum()
+            ctr = (grouped['clicks'] / grouped['impressions'].replace(0, np.nan)).sort_values(ascending=False).head(TOP_N)
+            rows, lines = _ranked(ctr, 'ctr', as_pct=True)
+            return f"CTR by campaign (top {len(rows)}):", {'ctr_by_campaign': rows}, lines
+
+    if intent == 'roas_by_campaign':
+        cols = _require(meta_df, 'campaign', 'spend', 'purchase_value')
+        if cols:
+            grouped = pd.DataFrame({
+                'spend': numeric(meta_df[cols['spend']]),
+                'value': numeric(meta_df[cols['purchase_value']]),
+            }).groupby(meta_df[cols['campaign']]).sum()
+            roas = (grouped['value'] / grouped['spend'].replace(0, np.nan)).sort_values(ascending=False).head(TOP_N)
+            rows, lines = _ranked(roas, 'roas')
+            return f"ROAS by campaign (top {len(rows)}):", {'roas_by_campaign': rows}, lines
+
+    if intent == 'revenue_by_product':
+        cols = _require(sales_df, 'product', 'revenue')
+        if cols:
+            totals = (numeric(sales_df[cols['revenue']]).groupby(sales_df[cols['product']]).sum()
+                      .sort_values(ascending=False).head(TOP_N))
+            rows, lines = _ranked(totals, 'revenue')
+            return f"Revenue by product (top {len(rows)}):", {'revenue_by_product': rows}, lines
+
+    if intent == 'best_selling_product':
+        product_col = find_column(sales_df, 'product')
+        measure = 'quantity' if find_column(sales_df, 'quantity') else 'revenue'
+        value_col = find_column(sales_df, measure)
+        if product_col and value_col:
+            totals = (numeric(sales_df[value_col]).groupby(sales_df[product_col]).sum()
+                      .sort_values(ascending=False).head(TOP_N))
+            if totals.empty:
+                return None
+            rows, lines = _ranked(totals, measure, decimals=0 if measure == 'quantity' else 2)
+            best = totals.index[0]
+            return (f"Best-selling product by {value_col}: {best} ({fmt(totals.iloc[0], 0 if measure == 'quantity' else 2)})",
+                    {'best_selling_product': str(best), 'measure': value_col, 'ranking': rows}, lines)
+
+    return None
+
+
+def answer_kpi_question(question, meta_df, sales_df, row_index=None):
+    """Answer a standard KPI question locally, or return None to let Claude handle it"""
+    row_index = row_index or {}
+    matches = {d: match_entities(question, dataset_index) for d, dataset_index in row_index.items()}
+
+    # Entity names are removed first, so a "Black Friday" campaign isn't read as a
+    # date and whatever words remain must all be understood by the intent catalog
+    all_matches = {}
+    for dataset_matches in matches.values():
+        all_matches.update(dataset_matches)
+    time_text = strip_matched_names(question, all_matches)
+
+    intent = match_intent(time_text)
+    if intent is None:
+        return None
+    name, dataset = intent
+
+    # A name from a dataset the KPI isn't computed on can't be applied as a filter;
+    # ROAS mixes both datasets, so it is only answered unfiltered by entity
+    datasets = ['meta', 'sales'] if dataset == 'both' else [dataset]
+    used = [] if dataset == 'both' else datasets
+    if any(dataset_matches for d, dataset_matches in matches.items() if d not in used):
+        return None
+    matches = {d: matches.get(d, {}) for d in datasets}
+
+    if row_index:
+        anchor = anchor_date(row_index)
+    else:
+        # No index (older session): anchor relative dates on the data itself
+        dates = [parse_dates(df[col]).max() for df in (meta_df, sales_df)
+                 for col in [find_date_column(df)] if col is not None]
+        dates = [d for d in dates if pd.notna(d)]
+        anchor = max(dates).date() if dates else None
+    time_range = parse_time_range(time_text, anchor) if anchor else None
+
+    # Every number and time word must be accounted for by the resolved range,
+    # e.g. "on 11/05" or "last 7 days in 2023" can't be answered exactly
+    words = normalize(time_text).split()
+    if time_range is None:
+        if TIME_WORDS_PATTERN.search(' '.join(words)):
+            return None
+    elif not {w for w in words if w.isdigit()} <= set(normalize(time_range[2]).split()):
+        return None
+
+    frames = {'meta': meta_df, 'sales': sales_df}
+    scope = []
+    for d in datasets:
+        frames[d], dataset_scope = _scope(frames[d], row_index.get(d), matches[d], time_range)
+        if frames[d] is None:
+            return None
+        scope += dataset_scope
+    meta_df, sales_df = frames['meta'], frames['sales']
+
+    computed = compute(name, meta_df, sales_df)
+    if computed is None:
+        return None
+    headline, result, lines = computed
+
+    scope_text = f" [{'; '.join(dict.fromkeys(scope))}]" if scope else ' [all rows]'
+    answer = '\n'.join([headline + scope_text] + lines)
+    return {
+        'answer': answer,
+        'kpi': name,
+        'result': result,
+        'scope': list(dict.fromkeys(scope)),
+    }
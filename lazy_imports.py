@@ -0,0 +1,48 @@
+"""
+Deferred imports for the heavy libraries (pandas, numpy, anthropic).
+
+Routes like `/` and `/session-status` never touch them, so each module is
+only imported the first time one of its attributes is used.
+"""
+
+import importlib
+import threading
+import time
+
+
+class LazyModule:
+    """Module proxy that imports the real module on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    IMPORT_TIMINGS[self._name] = round((time.perf_counter() - start) * 1000, 1)
+                    self._module = module
+        return self._module
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+# module name -> milliseconds spent importing it
+IMPORT_TIMINGS = {}
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+anthropic = LazyModule('anthropic')
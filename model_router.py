@@ -0,0 +1,85 @@
+"""
+Latency-aware model routing.
+
+Classifies each Claude request locally (question complexity, analysis type and
+context size) and picks either the fast model with a tight token budget or the
+deep model for full analyses. Models and limits are configured via .env.
+"""
+
+import os
+import re
+
+FAST_TIER = 'fast'
+DEEP_TIER = 'deep'
+
+MODEL_TIERS = {
+    FAST_TIER: {
+        'model': os.getenv('CLAUDE_FAST_MODEL', 'claude-3-5-haiku-20241022'),
+        'max_tokens': int(os.getenv('CLAUDE_FAST_MAX_TOKENS', '1000')),
+    },
+    DEEP_TIER: {
+        'model': os.getenv('CLAUDE_DEEP_MODEL', 'claude-3-5-sonnet-20241022'),
+        'max_tokens': int(os.getenv('CLAUDE_DEEP_MAX_TOKENS', '4000')),
+    },
+}
+
+# Analysis types that always need the large model; any other analysis without
+# question text is a full analysis too and also goes deep
+DEEP_ANALYSIS_TYPES = {'performance_summary', 'general'}
+
+# Prompts above this many characters go to the deep model regardless of the question
+DEEP_CONTEXT_CHARS = int(os.getenv('ROUTER_DEEP_CONTEXT_CHARS', '20000'))
+
+# Questions longer than this (in words) are treated as open-ended
+DEEP_QUESTION_WORDS = int(os.getenv('ROUTER_DEEP_QUESTION_WORDS', '30'))
+
+DEEP_KEYWORDS = re.compile(
+    r'\b(why|analy[sz]e|analysis|recommend\w*|optimi[sz]\w*|strateg\w*|compare|comparison|'
+    r'correlat\w*|trend\w*|forecast\w*|predict\w*|insight\w*|explain|diagnos\w*|'
+    r'improve|scale|attribut\w*|opportunit\w*|deep dive|in detail|comprehensive)\b',
+    re.IGNORECASE
+)
+
+SIMPLE_KEYWORDS = re.compile(
+    r'\b(what is|what\'s|how many|how much|total|sum|count|list|which|show|summar\w*|'
+    r'average|avg|top|best|highest|lowest)\b',
+    re.IGNORECASE
+)
+
+
+def classify_question(question):
+    """Return (tier, reason) for a free-text question"""
+    words = len(question.split())
+
+    if DEEP_KEYWORDS.search(question):
+        return DEEP_TIER, 'open-ended question'
+    if words > DEEP_QUESTION_WORDS:
+        return DEEP_TIER, f'long question ({words} words)'
+    if SIMPLE_KEYWORDS.search(question):
+        return FAST_TIER, 'simple lookup or summary'
+    if words <= 12:
+        return FAST_TIER, f'short question ({words} words)'
+    return DEEP_TIER, 'unclassified question'
+
+
+def route_request(question=None, analysis_type=None, context_chars=0, tier_override=None):
+    """Pick the model and token budget for a Claude request"""
+    if tier_override in MODEL_TIERS:
+        tier, reason = tier_override, 'requested by client'
+    elif analysis_type in DEEP_ANALYSIS_TYPES:
+        tier, reason = DEEP_TIER, f'analysis type {analysis_type}'
+    elif context_chars > DEEP_CONTEXT_CHARS:
+        tier, reason = DEEP_TIER, f'large context ({context_chars} chars)'
+    elif question:
+        tier, reason = classify_question(question)
+    elif analysis_type:
+        tier, reason = DEEP_TIER, f'analysis type {analysis_type}'
+    else:
+        tier, reason = FAST_TIER, 'no question text'
+
+    return {
+        'tier': tier,
+        'model': MODEL_TIERS[tier]['model'],
+        'max_tokens': MODEL_TIERS[tier]['max_tokens'],
+        'reason': reason,
+    }
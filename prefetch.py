@@ -0,0 +1,162 @@
+"""
+Speculative prefetch of standard analyses right after upload.
+
+When enabled, `/upload` schedules the configured analysis types in the
+background. Results are keyed to the upload version, so `/detailed-analysis`
+either returns a finished result instantly or waits on the in-flight
+computation. Finished results are also written next to the session file, so
+workers other than the one that ran the prefetch can serve them. A new upload
+or `/clear-data` cancels the session's prefetches: queued ones never start and
+running ones abandon their Claude call.
+"""
+
+import glob
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from resilience import CallCancelled
+from serialization import dumps, loads
+
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', 'false').lower() == 'true'
+PREFETCH_ANALYSIS_TYPES = [t.strip() for t in os.getenv('PREFETCH_ANALYSIS_TYPES', 'performance_summary').split(',') if t.strip()]
+PREFETCH_CONCURRENCY = int(os.getenv('PREFETCH_CONCURRENCY', '2'))
+PREFETCH_MAX_SESSIONS = int(os.getenv('PREFETCH_MAX_SESSIONS', '100'))
+
+# Analysis types become part of a file name
+SAFE_NAME = re.compile(r'^[A-Za-z0-9_-]+$')
+
+
+class PrefetchCancelled(Exception):
+    """Raised by a queued prefetch whose upload was superseded before it started"""
+
+
+class Prefetcher:
+    """Background analyses per session, keyed to the upload version that started them"""
+
+    def __init__(self, results_folder=None, concurrency=PREFETCH_CONCURRENCY, max_sessions=PREFETCH_MAX_SESSIONS):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='prefetch')
+        self._results_folder = results_folder
+        self._max_sessions = max_sessions
+        # session_id -> {'version', 'cancelled' (Event), 'tasks': {analysis_type: Future}}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def schedule(self, session_id, version, analysis_types, run_fn):
+        """Start run_fn(analysis_type, cancel_event) for each type, superseding earlier prefetches.
+
+        run_fn should stop early once cancel_event is set.
+        """
+        self.cancel(session_id)
+        cancelled = threading.Event()
+
+        def task(analysis_type):
+            if cancelled.is_set():
+                raise PrefetchCancelled(analysis_type)
+            print(f"🔮 Prefetching {analysis_type} for session {session_id}")
+            try:
+                result = run_fn(analysis_type, cancelled)
+            except CallCancelled:
+                raise PrefetchCancelled(analysis_type)
+            if not cancelled.is_set():
+                self._persist(session_id, version, analysis_type, result)
+            return result
+
+        job = {'version': version, 'cancelled': cancelled, 'tasks': {}}
+        with self._lock:
+            for analysis_type in analysis_types:
+                job['tasks'][analysis_type] = self._executor.submit(task, analysis_type)
+            self._jobs[session_id] = job
+            while len(self._jobs) > self._max_sessions:
+                _, oldest = self._jobs.popitem(last=False)
+                self._cancel_job(oldest)
+        return list(job['tasks'])
+
+    def lookup(self, session_id, version, analysis_type):
+        """Return the prefetch Future for this upload version and type, or None.
+
+        Checks this process's jobs first, then results persisted by any worker.
+        """
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is not None and job['version'] == version and not job['cancelled'].is_set():
+                future = job['tasks'].get(analysis_type)
+                if future is not None:
+                    return future
+
+        result = self._load_persisted(session_id, version, analysis_type)
+        if result is None:
+            return None
+        future = Future()
+        future.set_result(result)
+        return future
+
+    def cancel(self, session_id):
+        """Cancel a session's prefetches (new upload or cleared data)"""
+        with self._lock:
+            job = self._jobs.pop(session_id, None)
+        if job is not None:
+            self._cancel_job(job)
+            print(f"🛑 Cancelled prefetches for session {session_id}")
+        self._remove_persisted(session_id)
+
+    def _result_path(self, session_id, analysis_type):
+        if not self._results_folder or not SAFE_NAME.match(analysis_type):
+            return None
+        return os.path.join(self._results_folder, f"{session_id}_prefetch_{analysis_type}.json")
+
+    def _persist(self, session_id, version, analysis_type, result):
+        filepath = self._result_path(session_id, analysis_type)
+        if filepath is None:
+            return
+        try:
+            # Write then rename, so another worker never reads a partial file
+            tmp_path = f"{filepath}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps({'version': version, 'result': result}))
+            os.replace(tmp_path, filepath)
+        except Exception as e:
+            print(f"❌ Error saving prefetched {analysis_type}: {e}")
+
+    def _load_persisted(self, session_id, version, analysis_type):
+        filepath = self._result_path(session_id, analysis_type)
+        if filepath is None or not os.path.exists(filepath):
+            return None
+        try:
+            with open(filepath, 'rb') as f:
+                stored = loads(f.read())
+        except Exception as e:
+            print(f"❌ Error loading prefetched {analysis_type}: {e}")
+            return None
+        return stored['result'] if stored.get('version') == version else None
+
+    def _remove_persisted(self, session_id):
+        if not self._results_folder:
+            return
+        for filepath in glob.glob(os.path.join(self._results_folder, f"{session_id}_prefetch_*.json")):
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+
+    @staticmethod
+    def _cancel_job(job):
+        # Queued tasks never start; running ones see the event and abandon their call
+        job['cancelled'].set()
+        for future in job['tasks'].values():
+            future.cancel()
+
+    def status(self, session_id):
+        with self._lock:
+            job = self._jobs.get(session_id)
+            if job is None:
+                return {}
+            tasks = dict(job['tasks'])
+        return {
+            analysis_type: ('running' if future.running() else
+                            'pending' if not future.done() else
+                            'failed' if future.exception() is not None else 'ready')
+            for analysis_type, future in tasks.items()
+        }
@@ -0,0 +1,135 @@
+"""
+Batch reports: answer a list of questions (or a named template) concurrently
+against one shared dataset context and persist the assembled report.
+"""
+
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+from serialization import dumps
+
+REPORTS_FOLDER = 'reports'
+REPORT_CONCURRENCY = int(os.getenv('REPORT_CONCURRENCY', '5'))
+MAX_REPORT_QUESTIONS = int(os.getenv('MAX_REPORT_QUESTIONS', '30'))
+
+REPORT_TEMPLATES = {
+    'weekly_client': [
+        "What is the total ad spend?",
+        "What is the total revenue from sales?",
+        "What is the overall ROAS?",
+        "What is the overall CTR?",
+        "What is the average cost per click?",
+        "Which campaigns spent the most?",
+        "Which campaigns generated the most conversions?",
+        "Which ad sets have the lowest cost per result?",
+        "Which products sold the most units?",
+        "Which products generated the most revenue?",
+        "How did daily sales trend over the period?",
+        "How did daily ad spend trend over the period?",
+        "Which campaigns are underperforming and why?",
+        "What correlation is there between ad spend and sales?",
+        "Which ad sets should we scale up and which should we pause?",
+        "What are the top three optimization recommendations for next week?",
+    ],
+    'campaign_health': [
+        "Which campaigns spent the most?",
+        "Which campaigns have the best and worst CTR?",
+        "Which campaigns have the best and worst ROAS?",
+        "Are there campaigns with rising costs per result?",
+        "Which campaigns should be paused, scaled or restructured?",
+    ],
+    'product_performance': [
+        "Which products sold the most units?",
+        "Which products generated the most revenue?",
+        "Which products are declining in sales?",
+        "Which products look most responsive to ad spend?",
+    ],
+}
+
+
+def resolve_questions(data):
+    """Return (questions, template_name, error) from a report request body"""
+    template = data.get('template')
+    questions = data.get('questions')
+
+    if template:
+        if template not in REPORT_TEMPLATES:
+            return None, None, f"Unknown report template '{template}'. Available: {', '.join(REPORT_TEMPLATES)}"
+        questions = REPORT_TEMPLATES[template]
+
+    if not questions or not isinstance(questions, list):
+        return None, None, 'Provide a list of questions or a report template'
+
+    questions = [str(q).strip() for q in questions if str(q).strip()]
+    if not questions:
+        return None, None, 'Provide a list of questions or a report template'
+    if len(questions) > MAX_REPORT_QUESTIONS:
+        return None, None, f'A report can contain at most {MAX_REPORT_QUESTIONS} questions'
+
+    return questions, template, None
+
+
+def run_report(questions, answer_fn, concurrency=REPORT_CONCURRENCY):
+    """Answer questions concurrently, yielding one result dict per question as it completes"""
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(questions)))) as executor:
+        futures = {executor.submit(answer_fn, question): index for index, question in enumerate(questions)}
+        for future in as_completed(futures):
+            index = futures[future]
+            result = {'index': index, 'question': questions[index]}
+            try:
+                result.update(future.result())
+            except Exception as e:
+                print(f"❌ Report question {index} failed: {e}")
+                result['error'] = str(e)
+            yield result
+
+
+def new_report_id():
+    return uuid.uuid4().hex
+
+
+def save_report(report):
+    """Persist an assembled report as JSON"""
+    try:
+        os.makedirs(REPORTS_FOLDER, exist_ok=True)
+        filepath = os.path.join(REPORTS_FOLDER, f"{report['report_id']}.json")
+        with open(filepath, 'wb') as f:
+            f.write(dumps(report))
+        print(f"✅ Report saved to file: {filepath}")
+        return True
+    except Exception as e:
+        print(f"❌ Error saving report: {e}")
+        return False
+
+
+def load_report(report_id):
+    """Return the persisted report's JSON bytes, or None if it does not exist"""
+    # Report ids are hex uuids - reject anything else so the id can't escape the folder
+    try:
+        uuid.UUID(hex=report_id)
+    except ValueError:
+        return None
+
+    filepath = os.path.join(REPORTS_FOLDER, f"{report_id}.json")
+    if not os.path.exists(filepath):
+        return None
+    with open(filepath, 'rb') as f:
+        return f.read()
+
+
+def assemble_report(report_id, session_id, template, questions, results, started_at):
+    """Build the persisted report document with answers in question order"""
+    ordered = sorted(results, key=lambda r: r['index'])
+    return {
+        'report_id': report_id,
+        'session_id': session_id,
+        'template': template,
+        'question_count': len(questions),
+        'failed_count': sum(1 for r in ordered if 'error' in r),
+        'results': ordered,
+        'started_at': started_at.isoformat(),
+        'completed_at': datetime.now().isoformat(),
+        'elapsed_ms': round((datetime.now() - started_at).total_seconds() * 1000),
+    }
@@ -0,0 +1,352 @@
+"""
+Resilience layer for upstream Claude calls.
+
+- Deadline: a per-request time budget, passed down as the SDK timeout
+- Hedging: when a call runs past the model's recent p95 latency, a second
+  identical request is sent and whichever finishes first wins. Hedges are
+  limited to a small share of calls and paused while upstream is failing
+- Circuit breaker: after repeated upstream failures calls fail fast with a
+  clear status instead of piling up workers, until a probe call succeeds.
+  Timeouts only count when the deadline was the server's own, not one a
+  client shortened
+- Cancellation: a deadline can carry a cancel event (used by prefetches);
+  setting it ends the wait at once and raises CallCancelled
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('CLAUDE_BREAKER_FAILURES', '5'))
+BREAKER_RESET_SECONDS = float(os.getenv('CLAUDE_BREAKER_RESET_SECONDS', '30'))
+HEDGE_ENABLED = os.getenv('CLAUDE_HEDGE_ENABLED', 'true').lower() == 'true'
+HEDGE_MIN_SAMPLES = int(os.getenv('CLAUDE_HEDGE_MIN_SAMPLES', '20'))
+# Token bucket: each call earns HEDGE_BUDGET_RATIO of a hedge, up to HEDGE_BUDGET_BURST saved
+HEDGE_BUDGET_RATIO = float(os.getenv('CLAUDE_HEDGE_BUDGET_RATIO', '0.1'))
+HEDGE_BUDGET_BURST = float(os.getenv('CLAUDE_HEDGE_BUDGET_BURST', '2'))
+LATENCY_WINDOW = 200
+CALL_POOL_SIZE = int(os.getenv('CLAUDE_CALL_POOL_SIZE', '16'))
+# How often a wait checks for cancellation
+CANCEL_POLL_SECONDS = 0.1
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while the circuit breaker is open"""
+
+    def __init__(self, retry_after):
+        self.retry_after = max(0, round(retry_after, 1))
+        super().__init__(f'Claude API circuit breaker is open after repeated failures. '
+                         f'Retry in {self.retry_after} seconds')
+
+
+class DeadlineExceeded(Exception):
+    """Raised when the request's time budget runs out before upstream answers"""
+
+
+class CallCancelled(Exception):
+    """Raised when the deadline's cancel event is set before upstream answers"""
+
+
+class Deadline:
+    """Absolute point in time by which a request must have its answer.
+
+    client_set marks a budget the client shortened; running out of it says
+    nothing about upstream health. cancel_event (a threading.Event) lets the
+    owner abandon the call early.
+    """
+
+    def __init__(self, seconds, client_set=False, cancel_event=None):
+        self.seconds = seconds
+        self.client_set = client_set
+        self.cancel_event = cancel_event
+        self.expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    @property
+    def cancellable(self):
+        return self.cancel_event is not None
+
+    def cancelled(self):
+        return self.cancel_event is not None and self.cancel_event.is_set()
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies for one model"""
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, p):
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p / 100 * len(samples)))]
+
+    def hedge_delay(self):
+        """p95 latency, once there are enough samples to trust it"""
+        with self._lock:
+            count = len(self._samples)
+        return self.percentile(95) if count >= HEDGE_MIN_SAMPLES else None
+
+    def snapshot(self):
+        p50, p95 = self.percentile(50), self.percentile(95)
+        with self._lock:
+            count = len(self._samples)
+        return {
+            'samples': count,
+            'p50_ms': round(p50 * 1000) if p50 is not None else None,
+            'p95_ms': round(p95 * 1000) if p95 is not None else None,
+        }
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe"""
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.last_failure = None
+        self.last_failure_at = None
+        self.times_opened = 0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go upstream now"""
+        with self._lock:
+            if self.state == OPEN:
+                waited = time.monotonic() - self.opened_at
+                if waited < self.reset_seconds:
+                    raise CircuitOpenError(self.reset_seconds - waited)
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    raise CircuitOpenError(self.reset_seconds)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print("✅ Claude circuit breaker closed")
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self, error):
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_failure = f'{type(error).__name__}: {error}'
+            self.last_failure_at = time.monotonic()
+            self._probe_in_flight = False
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.times_opened += 1
+                    print(f"⚠️ Claude circuit breaker opened after {self.consecutive_failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    def healthy(self):
+        """Closed, with no failure within the last reset period"""
+        with self._lock:
+            return self.state == CLOSED and (
+                self.last_failure_at is None or time.monotonic() - self.last_failure_at >= self.reset_seconds
+            )
+
+    def release_probe(self):
+        """Let another probe through if a half-open call ended without an upstream verdict"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self):
+        with self._lock:
+            retry_after = None
+            if self.state == OPEN:
+                retry_after = round(max(0.0, self.reset_seconds - (time.monotonic() - self.opened_at)), 1)
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'reset_seconds': self.reset_seconds,
+                'retry_after_seconds': retry_after,
+                'times_opened': self.times_opened,
+                'last_failure': self.last_failure,
+            }
+
+
+class HedgeBudget:
+    """Token bucket limiting hedged requests to a share of recent calls"""
+
+    def __init__(self, ratio=HEDGE_BUDGET_RATIO, burst=HEDGE_BUDGET_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self):
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self):
+        """Take one hedge from the bucket; False when the budget is used up"""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class ResilientCaller:
+    """Runs upstream calls under a deadline, with hedging and a shared circuit breaker.
+
+    is_upstream_failure(error) decides which errors count towards the breaker;
+    is_timeout(error) recognises upstream timeouts, which only count when the
+    deadline was not shortened by the client.
+    """
+
+    def __init__(self, is_upstream_failure, is_timeout=None):
+        self.is_upstream_failure = is_upstream_failure
+        self.is_timeout = is_timeout or (lambda error: False)
+        self.breaker = CircuitBreaker()
+        self.hedge_budget = HedgeBudget()
+        self._latency = {}
+        self._executor = ThreadPoolExecutor(max_workers=CALL_POOL_SIZE, thread_name_prefix='claude-call')
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'hedges_sent': 0, 'hedges_won': 0, 'hedges_skipped_budget': 0,
+                      'hedges_skipped_unhealthy': 0, 'deadline_exceeded': 0, 'rejected_open': 0,
+                      'cancelled': 0}
+
+    def _tracker(self, key):
+        with self._lock:
+            if key not in self._latency:
+                self._latency[key] = LatencyTracker()
+            return self._latency[key]
+
+    def _count(self, stat):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _wait(self, pending, timeout, deadline, return_when=FIRST_COMPLETED):
+        """wait() that gives up early, raising CallCancelled, once the deadline is cancelled"""
+        if not deadline.cancellable:
+            return wait(pending, timeout=timeout, return_when=return_when)
+        end = time.monotonic() + timeout
+        while True:
+            if deadline.cancelled():
+                self._count('cancelled')
+                self.breaker.release_probe()
+                raise CallCancelled('Call cancelled by its owner')
+            done, not_done = wait(pending, timeout=min(CANCEL_POLL_SECONDS, max(0.0, end - time.monotonic())),
+                                  return_when=return_when)
+            if done or time.monotonic() >= end:
+                return done, not_done
+
+    def call(self, key, fn, deadline):
+        """Call fn(timeout_seconds) for the given latency key and return its result.
+
+        Raises CircuitOpenError, DeadlineExceeded, CallCancelled, or the upstream error.
+        """
+        try:
+            self.breaker.before_call()
+        except CircuitOpenError:
+            self._count('rejected_open')
+            raise
+        self._count('calls')
+        self.hedge_budget.earn()
+
+        if deadline.cancelled():
+            self.breaker.release_probe()
+            self._count('cancelled')
+            raise CallCancelled('Call cancelled before it was sent')
+        if deadline.expired():
+            self.breaker.release_probe()
+            self._count('deadline_exceeded')
+            raise DeadlineExceeded('Request deadline passed before calling Claude')
+
+        tracker = self._tracker(key)
+        start = time.monotonic()
+        primary = self._executor.submit(fn, deadline.remaining())
+        pending = {primary}
+
+        hedge_delay = tracker.hedge_delay() if HEDGE_ENABLED else None
+        if hedge_delay is not None and hedge_delay < deadline.remaining():
+            done, _ = self._wait(pending, hedge_delay, deadline)
+            if done:
+                pass
+            elif not self.breaker.healthy():
+                # Upstream is already struggling; a second request only adds load
+                self._count('hedges_skipped_unhealthy')
+            elif not self.hedge_budget.spend():
+                self._count('hedges_skipped_budget')
+            else:
+                print(f"🪁 Hedging {key} call after {round(hedge_delay * 1000)} ms (p95)")
+                self._count('hedges_sent')
+                pending.add(self._executor.submit(fn, deadline.remaining()))
+
+        last_error = None
+        while pending:
+            done, pending = self._wait(pending, deadline.remaining(), deadline)
+            if not done:
+                # Abandon the in-flight calls; their SDK timeouts end them shortly
+                self._count('deadline_exceeded')
+                self._record_timeout(deadline, DeadlineExceeded('deadline exceeded'))
+                raise DeadlineExceeded(f'Claude did not answer within {deadline.seconds} seconds')
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    tracker.record(time.monotonic() - start)
+                    if future is not primary:
+                        self._count('hedges_won')
+                    self.breaker.record_success()
+                    return future.result()
+                last_error = error
+
+        if isinstance(last_error, CallCancelled):
+            self._count('cancelled')
+            self.breaker.release_probe()
+        elif self.is_timeout(last_error):
+            self._record_timeout(deadline, last_error)
+        elif self.is_upstream_failure(last_error):
+            self.breaker.record_failure(last_error)
+        else:
+            self.breaker.release_probe()
+        raise last_error
+
+    def _record_timeout(self, deadline, error):
+        # A client asking for a 50 ms answer must not open the breaker for everyone
+        if deadline.client_set:
+            self.breaker.release_probe()
+        else:
+            self.breaker.record_failure(error)
+
+    def health(self):
+        with self._lock:
+            latency = {key: tracker.snapshot() for key, tracker in self._latency.items()}
+            stats = dict(self.stats)
+        return {
+            'circuit_breaker': self.breaker.snapshot(),
+            'latency': latency,
+            'hedging_enabled': HEDGE_ENABLED,
+            'hedge_budget': {'ratio': self.hedge_budget.ratio, 'burst': self.hedge_budget.burst,
+                             'available': round(self.hedge_budget.tokens, 2)},
+            'stats': stats,
+        }
@@ -0,0 +1,338 @@
+"""
+Question-aware context selection for Claude prompts.
+
+At upload an index is built over the entity columns of each dataset (campaign,
+ad set, ad, product, SKU...) plus their date ranges. At question time the
+entity names and time expressions mentioned in the question are matched
+against the index, and only the matching row slices and their aggregates are
+put in the prompt, within a token budget.
+"""
+
+import os
+import re
+from datetime import date, timedelta
+
+from lazy_imports import pd, np
+from serialization import dumps_str
+
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv('RETRIEVAL_TOKEN_BUDGET', '3000'))
+ENTITY_MAX_VALUES = int(os.getenv('RETRIEVAL_ENTITY_MAX_VALUES', '50000'))
+MAX_MATCHES_PER_COLUMN = 20
+CHARS_PER_TOKEN = 4
+
+ENTITY_COLUMN_PATTERN = re.compile(
+    r'campaign|ad ?set|adset|\bad\b|ad name|product|sku|variant|title|item|lineitem',
+    re.IGNORECASE
+)
+DATE_COLUMN_PATTERN = re.compile(r'date|day|reporting starts|reporting ends|created|time|week|month', re.IGNORECASE)
+
+# Words that appear in many entity names and say nothing about which one is meant
+GENERIC_TOKENS = {
+    'the', 'and', 'for', 'with', 'campaign', 'campaigns', 'adset', 'set', 'sets', 'ads',
+    'product', 'products', 'sale', 'sales', 'new', 'copy', 'test', 'all', 'old',
+}
+
+MONTHS = {
+    'jan': 1, 'january': 1, 'feb': 2, 'february': 2, 'mar': 3, 'march': 3, 'apr': 4, 'april': 4,
+    'may': 5, 'jun': 6, 'june': 6, 'jul': 7, 'july': 7, 'aug': 8, 'august': 8,
+    'sep': 9, 'sept': 9, 'september': 9, 'oct': 10, 'october': 10, 'nov': 11, 'november': 11,
+    'dec': 12, 'december': 12,
+}
+
+
+def normalize(text):
+    return ' '.join(re.findall(r'[a-z0-9]+', str(text).lower()))
+
+
+def significant_tokens(normalized):
+    return frozenset(t for t in normalized.split() if (len(t) >= 3 or t.isdigit()) and t not in GENERIC_TOKENS)
+
+
+def find_date_column(df):
+    """Return the first column whose name looks like a date and whose values parse as dates"""
+    for col in df.columns:
+        if not DATE_COLUMN_PATTERN.search(str(col)):
+            continue
+        sample = df[col].dropna().head(200)
+        if sample.empty:
+            continue
+        parsed = pd.to_datetime(sample.astype(str), errors='coerce')
+        if parsed.notna().mean() >= 0.8:
+            return col
+    return None
+
+
+def parse_dates(series):
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series.astype(str), errors='coerce')
+
+
+def build_dataset_index(df):
+    """Index one dataset: entity values -> row positions, plus its date column and range"""
+    entities = {}
+    for col in df.columns:
+        if not ENTITY_COLUMN_PATTERN.search(str(col)) or df[col].dtype != object:
+            continue
+        groups = df.groupby(col, sort=False).indices
+        if not groups or len(groups) > ENTITY_MAX_VALUES:
+            continue
+        entries = []
+        for value, positions in groups.items():
+            normalized = normalize(value)
+            if len(normalized) < 2:
+                continue
+            entries.append({
+                'value': value,
+                'normalized': normalized,
+                'tokens': significant_tokens(normalized),
+                'positions': np.asarray(positions, dtype=np.int64),
+            })
+        if entries:
+            entities[col] = entries
+
+    date_column = find_date_column(df)
+    date_range = None
+    if date_column is not None:
+        dates = parse_dates(df[date_column])
+        if dates.notna().any():
+            date_range = (dates.min().date().isoformat(), dates.max().date().isoformat())
+
+    return {'entities': entities, 'date_column': date_column, 'date_range': date_range}
+
+
+def build_index(meta_df, sales_df):
+    """Build the retrieval index stored with the session at upload"""
+    return {'meta': build_dataset_index(meta_df), 'sales': build_dataset_index(sales_df)}
+
+
+def match_entities(question, dataset_index):
+    """Return {column: [entries]} for entity values mentioned in the question"""
+    q_norm = f" {normalize(question)} "
+    q_tokens = set(q_norm.split())
+    matches = {}
+
+    for col, entries in dataset_index['entities'].items():
+        scored = []
+        for entry in entries:
+            if f" {entry['normalized']} " in q_norm:
+                scored.append((1.0, entry))
+                continue
+            tokens = entry['tokens']
+            if not tokens:
+                continue
+            overlap = len(tokens & q_tokens)
+            score = overlap / len(tokens)
+            if score >= 0.75 or (overlap >= 2 and score >= 0.5):
+                scored.append((score, entry))
+        if scored:
+            best = max(score for score, _ in scored)
+            matches[col] = [entry for score, entry in scored if score == best][:MAX_MATCHES_PER_COLUMN]
+
+    return matches
+
+
+def _black_friday(year):
+    # Fourth Thursday of November, plus one day
+    november_first = date(year, 11, 1)
+    first_thursday = november_first + timedelta(days=(3 - november_first.weekday()) % 7)
+    return first_thursday + timedelta(days=22)
+
+
+def _month_range(year, month):
+    start = date(year, month, 1)
+    end = date(year + (month == 12), month % 12 + 1, 1) - timedelta(days=1)
+    return start, end
+
+
+def parse_time_range(question, anchor):
+    """Resolve the first time expression in the question to (start, end, label).
+
+    Relative expressions ("last 7 days", "this month") are resolved against the
+    anchor date, which is the latest date in the data rather than today.
+    Returns None when the question has no recognised time expression.
+    """
+    text = question.lower()
+
+    try:
+        m = re.search(r'(\d{4}-\d{2}-\d{2})\s*(?:to|and|-|until|through)\s*(\d{4}-\d{2}-\d{2})', text)
+        if m:
+            start, end = date.fromisoformat(m.group(1)), date.fromisoformat(m.group(2))
+            return min(start, end), max(start, end), f'{m.group(1)} to {m.group(2)}'
+
+        m = re.search(r'\b(\d{4}-\d{2}-\d{2})\b', text)
+        if m:
+            day = date.fromisoformat(m.group(1))
+            return day, day, m.group(1)
+    except ValueError:
+        # Not a real calendar date, e.g. 2024-02-30
+        return None
+
+    m = re.search(r'\b(?:last|past|previous)\s+(\d+)\s+(day|week|month)s?\b', text)
+    if m:
+        n, unit = int(m.group(1)), m.group(2)
+        days = n * {'day': 1, 'week': 7, 'month': 30}[unit]
+        return anchor - timedelta(days=days - 1), anchor, f'last {n} {unit}s'
+
+    if re.search(r'\byesterday\b', text):
+        day = anchor - timedelta(days=1)
+        return day, day, 'yesterday'
+    if re.search(r'\btoday\b', text):
+        return anchor, anchor, 'today'
+
+    m = re.search(r'\b(this|last|previous)\s+(week|month|year)\b', text)
+    if m:
+        which, unit = m.group(1), m.group(2)
+        if unit == 'week':
+            start = anchor - timedelta(days=anchor.weekday())
+            if which != 'this':
+                start -= timedelta(days=7)
+            return start, start + timedelta(days=6), f'{which} week'
+        if unit == 'month':
+            year, month = anchor.year, anchor.month
+            if which != 'this':
+                year, month = (year - 1, 12) if month == 1 else (year, month - 1)
+            start, end = _month_range(year, month)
+            return start, end, f'{which} month'
+        year = anchor.year if which == 'this' else anchor.year - 1
+        return date(year, 1, 1), date(year, 12, 31), f'{which} year'
+
+    if re.search(r'\b(bfcm|black friday cyber monday)\b', text):
+        friday = _black_friday(anchor.year)
+        return friday, friday + timedelta(days=3), 'Black Friday - Cyber Monday'
+    if re.search(r'\bblack friday\b', text):
+        friday = _black_friday(anchor.year)
+        return friday, friday, 'Black Friday'
+    if re.search(r'\bcyber monday\b', text):
+        monday = _black_friday(anchor.year) + timedelta(days=3)
+        return monday, monday, 'Cyber Monday'
+
+    m = re.search(r'\b(' + '|'.join(sorted(MONTHS, key=len, reverse=True)) + r')\b(?:\s+(\d{4}))?', text)
+    if m and not (m.group(1) == 'may' and not m.group(2)):
+        month = MONTHS[m.group(1)]
+        year = int(m.group(2)) if m.group(2) else (anchor.year if month <= anchor.month else anchor.year - 1)
+        start, end = _month_range(year, month)
+        return start, end, start.strftime('%B %Y')
+
+    return None
+
+
+def strip_matched_names(question, matches):
+    """Remove matched entity names so e.g. a 'Black Friday' campaign isn't read as a date.
+
+    Works on the lowercased question rather than its normalized form, so ISO dates
+    like 2024-11-05 survive for parse_time_range.
+    """
+    text = f" {str(question).lower()} "
+    for entries in matches.values():
+        for entry in entries:
+            words = [entry['normalized'].split()] + [[token] for token in entry['tokens']]
+            for parts in words:
+                pattern = r'(?<![\w-])' + r'[^a-z0-9]+'.join(map(re.escape, parts)) + r'(?![\w-])'
+                text = re.sub(pattern, ' ', text)
+    return text
+
+
+def anchor_date(row_index):
+    """Latest date present in either dataset, or today if neither has dates"""
+    ends = [idx['date_range'][1] for idx in row_index.values() if idx.get('date_range')]
+    return date.fromisoformat(max(ends)) if ends else date.today()
+
+
+def select_rows(df, dataset_index, matches, time_range):
+    """Return (positions, description) for the rows relevant to the question, or (None, None)"""
+    mask = None
+    description = []
+
+    if matches:
+        mask = np.zeros(len(df), dtype=bool)
+        for col, entries in matches.items():
+            for entry in entries:
+                mask[entry['positions'][entry['positions'] < len(df)]] = True
+            names = ', '.join(str(e['value']) for e in entries[:5])
+            description.append(f"{col}: {names}{' ...' if len(entries) > 5 else ''}")
+
+    if time_range and dataset_index.get('date_column') in df.columns:
+        start, end, label = time_range
+        dates = parse_dates(df[dataset_index['date_column']]).dt.date
+        date_mask = ((dates >= start) & (dates <= end)).to_numpy()
+        mask = date_mask if mask is None else mask & date_mask
+        description.append(f"{label} ({start.isoformat()} to {end.isoformat()})")
+
+    if mask is None:
+        return None, None
+    return np.flatnonzero(mask), '; '.join(description)
+
+
+def summarize_rows(df, matches):
+    """Aggregates for the selected rows: numeric totals and averages, per matched entity"""
+    numeric = df.select_dtypes(include='number')
+    if numeric.empty:
+        return {'rows': len(df)}
+    summary = {
+        'rows': len(df),
+        'totals': numeric.sum().round(2).to_dict(),
+        'averages': numeric.mean().round(2).to_dict(),
+    }
+    for col in matches or {}:
+        if col in df.columns:
+            grouped = df.groupby(col)[list(numeric.columns)].sum().round(2)
+            summary[f'totals by {col}'] = grouped.to_dict('index')
+    return summary
+
+
+def _rows_within_budget(df, char_budget):
+    """Serialize as many leading rows as fit in the character budget"""
+    records = []
+    used = 2
+    for record in df.head(200).to_dict('records'):
+        encoded = dumps_str(record)
+        if used + len(encoded) + 1 > char_budget:
+            break
+        records.append(record)
+        used += len(encoded) + 1
+    return records
+
+
+def build_relevant_context(question, frames, row_index, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """Return {dataset: prompt lines} for datasets with rows relevant to the question.
+
+    Datasets with no matching entities or time range are left out, so the caller
+    can fall back to a plain sample for them.
+    """
+    if not row_index:
+        return {}
+
+    matches = {name: match_entities(question, row_index[name]) for name in frames if name in row_index}
+    all_matches = {}
+    for dataset_matches in matches.values():
+        all_matches.update(dataset_matches)
+    time_range = parse_time_range(strip_matched_names(question, all_matches), anchor_date(row_index))
+
+    selections = {}
+    for name, df in frames.items():
+        if name not in row_index:
+            continue
+        positions, description = select_rows(df, row_index[name], matches[name], time_range)
+        if positions is not None:
+            selections[name] = (positions, description)
+
+    if not selections:
+        return {}
+
+    char_budget = token_budget * CHARS_PER_TOKEN // len(selections)
+    sections = {}
+    for name, (positions, description) in selections.items():
+        selected = frames[name].take(positions)
+        summary_json = dumps_str(summarize_rows(selected, matches[name]))
+        lines = [f"- Rows matching the question ({description}): {len(selected)} of {len(frames[name])}"]
+        row_budget = char_budget
+        if len(summary_json) <= char_budget // 2:
+            lines.append(f"- Aggregates for matching rows: {summary_json}")
+            row_budget -= len(summary_json)
+        rows = _rows_within_budget(selected, row_budget)
+        if rows:
+            lines.append(f"- Matching rows ({len(rows)} of {len(selected)} shown): {dumps_str(rows)}")
+        sections[name] = lines
+
+    return sections
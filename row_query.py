@@ -0,0 +1,249 @@
+"""
+Server-side row browsing over the stored session DataFrames.
+
+Supports column selection, simple filter predicates, sorting and cursor-based
+pagination. Filters are evaluated only on the columns they reference, the
+matching row positions are cached per query, and only the requested page of
+the requested columns is ever serialized.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from lazy_imports import pd, np
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = int(os.getenv('ROWS_MAX_PAGE_SIZE', '1000'))
+POSITION_CACHE_SIZE = int(os.getenv('ROWS_POSITION_CACHE_SIZE', '32'))
+
+FILTER_OPS = {'eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'between', 'contains', 'in'}
+
+
+class QueryError(ValueError):
+    """Raised for malformed row queries - reported to the client as a 400"""
+
+
+# (session_id, version, query_key) -> ordered row positions matching the query
+_position_cache = OrderedDict()
+_position_lock = threading.Lock()
+
+
+def parse_query(data, frames):
+    """Validate a row query request body against the available datasets"""
+    dataset = data.get('dataset', 'meta')
+    if not isinstance(dataset, str) or dataset not in frames:
+        raise QueryError(f"Unknown dataset '{dataset}'. Use one of: {', '.join(frames)}")
+    df = frames[dataset]
+
+    columns = data.get('columns')
+    if columns:
+        if not isinstance(columns, list):
+            raise QueryError('columns must be a list of column names')
+        _check_columns(df, columns)
+    else:
+        columns = list(df.columns)
+
+    filters = data.get('filters') or []
+    if not isinstance(filters, list):
+        raise QueryError('filters must be a list of {column, op, value} objects')
+    for f in filters:
+        if not isinstance(f, dict) or 'column' not in f or 'op' not in f:
+            raise QueryError('Each filter needs a column and an op')
+        if not isinstance(f['op'], str) or f['op'] not in FILTER_OPS:
+            raise QueryError(f"Unsupported filter op '{f['op']}'. Use one of: {', '.join(sorted(FILTER_OPS))}")
+        _check_columns(df, [f['column']])
+
+    sort_by = data.get('sort_by')
+    if sort_by is not None:
+        _check_columns(df, [sort_by])
+
+    descending = data.get('descending', False)
+    if not isinstance(descending, bool):
+        raise QueryError('descending must be true or false')
+
+    try:
+        page_size = int(data.get('page_size', DEFAULT_PAGE_SIZE))
+    except (TypeError, ValueError):
+        raise QueryError('page_size must be an integer')
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+
+    return {
+        'dataset': dataset,
+        'columns': columns,
+        'filters': filters,
+        'sort_by': sort_by,
+        'descending': descending,
+        'page_size': page_size,
+        'cursor': data.get('cursor'),
+    }
+
+
+def _check_columns(df, columns):
+    """Check client-supplied column names, which JSON may have turned into anything"""
+    if not all(isinstance(c, str) for c in columns):
+        raise QueryError('Column names must be strings')
+    missing = [c for c in columns if c not in df.columns]
+    if missing:
+        raise QueryError(f"Unknown column(s): {', '.join(map(str, missing))}")
+
+
+def _query_key(query):
+    """Stable hash of everything that determines the matching row order"""
+    key = json.dumps([query['dataset'], query['filters'], query['sort_by'], query['descending']],
+                     sort_keys=True, default=str)
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def encode_cursor(offset, version, query_key):
+    raw = json.dumps({'o': offset, 'v': version, 'q': query_key}).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor, version, query_key):
+    """Return the row offset encoded in a cursor issued for this data version and query"""
+    if not cursor:
+        return 0
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        offset = int(payload['o'])
+    except Exception:
+        raise QueryError('Invalid cursor')
+    if payload.get('v') != version:
+        raise QueryError('Cursor is from a previous upload. Restart from the first page')
+    if payload.get('q') != query_key:
+        raise QueryError('Cursor does not match this query. Restart from the first page')
+    return max(0, offset)
+
+
+def _as_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _comparable(series, value):
+    """Return (series, value) coerced so that range comparisons make sense"""
+    if pd.api.types.is_numeric_dtype(series):
+        number = _as_number(value)
+        if number is None:
+            raise QueryError(f"Filter value '{value}' is not a number for column '{series.name}'")
+        return series, number
+    number = _as_number(value)
+    if number is not None:
+        return pd.to_numeric(series, errors='coerce'), number
+    # Strings (including ISO dates) compare lexicographically
+    return series.astype(str), str(value)
+
+
+def _filter_mask(df, f):
+    series = df[f['column']]
+    op = f['op']
+    value = f.get('value')
+
+    if op == 'contains':
+        return series.astype(str).str.contains(str(value), case=False, regex=False, na=False).to_numpy()
+
+    if op == 'in':
+        if not isinstance(value, list) or not all(v is None or isinstance(v, (str, int, float)) for v in value):
+            raise QueryError("The 'in' filter needs a list of strings or numbers")
+        return series.isin(value).to_numpy()
+
+    if op in ('eq', 'ne'):
+        if pd.api.types.is_numeric_dtype(series) and _as_number(value) is not None:
+            mask = (series == _as_number(value)).to_numpy()
+        else:
+            mask = (series.astype(str) == str(value)).to_numpy()
+        return ~mask if op == 'ne' else mask
+
+    if op == 'between':
+        if not isinstance(value, list) or len(value) != 2:
+            raise QueryError("The 'between' filter needs a [low, high] value")
+        low_series, low = _comparable(series, value[0])
+        high_series, high = _comparable(series, value[1])
+        return ((low_series >= low) & (high_series <= high)).to_numpy()
+
+    series, value = _comparable(series, value)
+    if op == 'gt':
+        return (series > value).to_numpy()
+    if op == 'gte':
+        return (series >= value).to_numpy()
+    if op == 'lt':
+        return (series < value).to_numpy()
+    return (series <= value).to_numpy()
+
+
+def _matching_positions(df, query):
+    """Row positions matching the filters, in the requested sort order"""
+    if query['filters']:
+        mask = np.ones(len(df), dtype=bool)
+        for f in query['filters']:
+            mask &= np.asarray(_filter_mask(df, f), dtype=bool)
+        positions = np.flatnonzero(mask)
+    else:
+        positions = np.arange(len(df))
+
+    if query['sort_by'] is not None and len(positions):
+        # Only the sort column is touched, and only for the matching rows
+        keys = df[query['sort_by']].take(positions).reset_index(drop=True)
+        order = keys.sort_values(ascending=not query['descending'], kind='stable', na_position='last').index.to_numpy()
+        positions = positions[order]
+
+    return positions
+
+
+def _cached_positions(session_id, version, query_key, df, query):
+    cache_key = (session_id, version, query_key)
+    with _position_lock:
+        if cache_key in _position_cache:
+            _position_cache.move_to_end(cache_key)
+            return _position_cache[cache_key]
+
+    positions = _matching_positions(df, query)
+
+    with _position_lock:
+        _position_cache[cache_key] = positions
+        while len(_position_cache) > POSITION_CACHE_SIZE:
+            _position_cache.popitem(last=False)
+    return positions
+
+
+def evict_session(session_id):
+    """Drop cached query results for a session (new upload or cleared data)"""
+    with _position_lock:
+        for key in [k for k in _position_cache if k[0] == session_id]:
+            del _position_cache[key]
+
+
+def _page_records(page_df):
+    """One page as records - NaN/NaT and numpy values are handled by the JSON encoder"""
+    return page_df.to_dict('records')
+
+
+def run_query(session_id, version, frames, query):
+    """Execute a parsed query and return one page of rows with the next cursor"""
+    df = frames[query['dataset']]
+    query_key = _query_key(query)
+    offset = decode_cursor(query['cursor'], version, query_key)
+
+    positions = _cached_positions(session_id, version, query_key, df, query)
+    page_positions = positions[offset:offset + query['page_size']]
+    # Select rows and columns in one step so only page_size x len(columns) cells are copied
+    page_df = df.iloc[page_positions, df.columns.get_indexer_for(query['columns'])]
+
+    next_offset = offset + len(page_positions)
+    return {
+        'dataset': query['dataset'],
+        'columns': query['columns'],
+        'rows': _page_records(page_df),
+        'page_size': query['page_size'],
+        'offset': offset,
+        'total_matches': int(len(positions)),
+        'total_rows': int(len(df)),
+        'next_cursor': encode_cursor(next_offset, version, query_key) if next_offset < len(positions) else None,
+    }
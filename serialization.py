@@ -0,0 +1,102 @@
+"""
+JSON serialization and response compression.
+
+All JSON in the app goes through orjson: Flask responses (via the JSON
+provider installed in create_app), prompt snippets, streamed report events
+and persisted reports. numpy, pandas and datetime values are handled natively,
+NaN/NaT become null, and responses are gzip-compressed when the client
+accepts it.
+"""
+
+import gzip
+import os
+import sys
+from datetime import date, datetime
+from decimal import Decimal
+
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+GZIP_MIN_BYTES = int(os.getenv('GZIP_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '5'))
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'application/x-ndjson', 'text/html', 'text/plain',
+    'text/css', 'application/javascript', 'text/javascript',
+}
+
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def _default(obj):
+    """Fallback for types orjson doesn't serialize natively"""
+    # pandas/numpy values can only appear once those modules have been imported
+    pd = sys.modules.get('pandas')
+    np = sys.modules.get('numpy')
+    if pd is not None:
+        if obj is pd.NaT or obj is pd.NA:
+            return None
+        if isinstance(obj, pd.Timestamp):
+            return obj.isoformat()
+        if isinstance(obj, pd.DataFrame):
+            return obj.to_dict('records')
+        if isinstance(obj, (pd.Series, pd.Index)):
+            return obj.tolist()
+    if np is not None and isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, Decimal):
+        return float(obj)
+    return str(obj)
+
+
+def dumps(obj):
+    """Encode to JSON bytes"""
+    return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+
+def dumps_str(obj):
+    """Encode to a JSON string, e.g. for prompts"""
+    return dumps(obj).decode()
+
+
+def loads(data):
+    return orjson.loads(data)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by orjson, so jsonify() gets the fast encoder"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_str(obj)
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj), mimetype=self.mimetype)
+
+
+def compress_response(response, accept_encoding):
+    """gzip a buffered response body when the client accepts it and it is worth it"""
+    if 'gzip' not in (accept_encoding or '').lower():
+        return response
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code < 200 or response.status_code >= 300
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    data = response.get_data()
+    if len(data) < GZIP_MIN_BYTES:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=GZIP_LEVEL))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.headers['Content-Length'] = str(len(response.get_data()))
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,37 @@
+import pandas as pd
+
+import anomalies
+from anomalies import detect_anomalies, has_overview
+
+DAYS = pd.date_range('2024-11-01', periods=20).strftime('%Y-%m-%d')
+
+
+def sales_frame():
+    return pd.DataFrame({
+        'Day': DAYS,
+        'Product title': ['Hoodie'] * 20,
+        'Net quantity': [1] * 20,
+        'Total sales': [50.0] * 19 + [500.0],
+    })
+
+
+def test_meta_without_outlier_metrics_keeps_sales_findings():
+    meta = pd.DataFrame({'Campaign name': ['Brand'] * 20, 'Reporting starts': DAYS, 'Impressions': range(1000, 1020)})
+    result = detect_anomalies(meta, sales_frame())
+    assert 'totals' in result['datasets']['meta']
+    assert any(f['dataset'] == 'sales' for f in result['findings'])
+    assert has_overview(result)
+
+
+def test_failing_dataset_is_skipped(monkeypatch):
+    real = anomalies._daily_series
+
+    def broken_for_meta(df, config):
+        if config is anomalies.DATASETS['meta']:
+            raise ValueError('bad data')
+        return real(df, config)
+
+    monkeypatch.setattr(anomalies, '_daily_series', broken_for_meta)
+    result = detect_anomalies(pd.DataFrame({'a': [1]}), sales_frame())
+    assert result['datasets']['meta'] == {'skipped': 'detection failed: bad data'}
+    assert 'totals' in result['datasets']['sales'] and result['findings']
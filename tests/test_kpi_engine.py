@@ -0,0 +1,128 @@
+import pandas as pd
+import pytest
+
+from kpi_engine import answer_kpi_question, match_intent
+from retrieval import build_index
+
+
+@pytest.mark.parametrize('question, intent', [
+    ('What is total spend?', 'total_spend'),
+    ('Total spend last 7 days', 'total_spend'),
+    ('What is the overall ROAS?', 'roas'),
+    ('What is the average cost per click?', 'cpc'),
+    ('What is the CTR?', 'ctr'),
+    ('CTR by campaign', 'ctr_by_campaign'),
+    ('Which campaigns spent the most?', 'spend_by_campaign'),
+    ('Which products sold the most units?', 'best_selling_product'),
+    ('What is the best selling product?', 'best_selling_product'),
+    ('Revenue in November', 'total_revenue'),
+    ('How many orders?', 'order_count'),
+])
+def test_match_intent_lookups(question, intent):
+    assert match_intent(question)[0] == intent
+
+
+@pytest.mark.parametrize('question', [
+    # Breakdowns the intent doesn't compute
+    'What is the spend by ad set?',
+    'What is the spend per day?',
+    'Which ad set has the highest CPC?',
+    'What is the ROAS by ad set?',
+    'Which day had the highest revenue?',
+    'What is the revenue per order?',
+    'What was the daily spend?',
+    'What is the spend for each of the last 7 days?',
+    'CTR by campaign per day',
+    'Which campaigns have the lowest CTR?',
+    # Qualifiers and names that aren't in the data
+    'What is the total spend for the Summer Sale campaign?',
+    'What is the CTR for mobile placements?',
+    'What is the spend this quarter?',
+    # Open-ended questions
+    'Why did ROAS drop?',
+    'Is our spend efficient?',
+    'How did daily sales trend over the period?',
+])
+def test_match_intent_falls_back(question):
+    assert match_intent(question) is None
+
+
+@pytest.fixture
+def frames():
+    days = [f'2024-11-{d:02d}' for d in range(1, 11)]
+    meta = pd.DataFrame({
+        'Campaign name': ['Brand', 'Black Friday Retargeting'] * 5,
+        'Reporting starts': days,
+        'Amount spent (USD)': [10.0] * 10,
+        'Impressions': [1000] * 10,
+        'Link clicks': [20] * 10,
+        'Purchases conversion value': [30.0] * 10,
+    })
+    sales = pd.DataFrame({
+        'Day': days,
+        'Product title': ['Hoodie', 'Tee'] * 5,
+        'Net quantity': [1, 2] * 5,
+        'Total sales': [50.0, 20.0] * 5,
+    })
+    return meta, sales, build_index(meta, sales)
+
+
+def test_answer_applies_matched_campaign(frames):
+    meta, sales, index = frames
+    result = answer_kpi_question('Total spend for the Black Friday Retargeting campaign', meta, sales, index)
+    assert result['result']['total_spend'] == 50.0
+    assert result['scope'] == ['Campaign name: Black Friday Retargeting']
+
+
+def test_answer_falls_back_on_unknown_campaign(frames):
+    meta, sales, index = frames
+    assert answer_kpi_question('What is the total spend for the Summer Sale campaign?', meta, sales, index) is None
+
+
+def test_answer_falls_back_on_name_from_other_dataset(frames):
+    meta, sales, index = frames
+    assert answer_kpi_question('What is the total spend for Hoodie?', meta, sales, index) is None
+
+
+def test_order_count_needs_order_column(frames):
+    meta, sales, index = frames
+    assert answer_kpi_question('How many orders?', meta, sales, index) is None
+    sales['Order ID'] = ['#1', '#1', '#2', '#3', '#3', '#4', '#5', '#6', '#7', '#7']
+    assert answer_kpi_question('How many orders?', meta, sales, build_index(meta, sales))['result']['orders'] == 7
+
+
+@pytest.mark.parametrize('question, spend', [
+    ('What is the total spend on 2024-11-05?', 10.0),
+    ('Total spend from 2024-11-01 to 2024-11-04', 40.0),
+    ('Total spend last 3 days', 30.0),
+])
+def test_answer_applies_time_range(frames, question, spend):
+    meta, sales, index = frames
+    assert answer_kpi_question(question, meta, sales, index)['result']['total_spend'] == spend
+
+
+def test_answer_applies_iso_date_without_index(frames):
+    meta, sales, _ = frames
+    result = answer_kpi_question('What is the total revenue on 2024-11-05?', meta, sales)
+    assert result['result']['total_revenue'] == 50.0
+
+
+@pytest.mark.parametrize('question', [
+    'What is the total revenue on 11/05?',
+    'What is the total revenue on 2024-02-30?',
+    'Total revenue last 7 days in 2023',
+    'Total revenue this weekend',
+    'Total revenue ytd',
+])
+def test_answer_falls_back_on_unresolved_time(frames, question):
+    meta, sales, index = frames
+    assert answer_kpi_question(question, meta, sales, index) is None
+
+
+def test_answer_falls_back_without_date_column(frames):
+    meta, sales, _ = frames
+    meta = meta.drop(columns=['Reporting starts'])
+    sales = sales.drop(columns=['Day'])
+    assert answer_kpi_question('Total revenue last 7 days', meta, sales) is None
+    assert answer_kpi_question('Total revenue last 7 days', meta, sales, build_index(meta, sales)) is None
+    assert answer_kpi_question('Total revenue', meta, sales)['result']['total_revenue'] == 350.0
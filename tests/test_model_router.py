@@ -0,0 +1,22 @@
+import pytest
+
+from model_router import DEEP_TIER, FAST_TIER, MODEL_TIERS, route_request
+
+
+@pytest.mark.parametrize('analysis_type', ['performance_summary', 'general', 'custom'])
+def test_analyses_use_deep_tier(analysis_type):
+    route = route_request(analysis_type=analysis_type, context_chars=500)
+    assert route['tier'] == DEEP_TIER
+    assert route['max_tokens'] == MODEL_TIERS[DEEP_TIER]['max_tokens']
+
+
+@pytest.mark.parametrize('question, tier', [
+    ('What is total spend?', FAST_TIER),
+    ('Why did ROAS drop last week?', DEEP_TIER),
+])
+def test_questions_are_classified(question, tier):
+    assert route_request(question=question)['tier'] == tier
+
+
+def test_no_question_or_analysis_uses_fast_tier():
+    assert route_request()['tier'] == FAST_TIER
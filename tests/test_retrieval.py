@@ -0,0 +1,77 @@
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from retrieval import build_index, build_relevant_context, parse_time_range, strip_matched_names
+
+ANCHOR = date(2024, 11, 10)
+
+
+@pytest.mark.parametrize('question, expected', [
+    ('How did sales do on 2024-11-05?', (date(2024, 11, 5), date(2024, 11, 5))),
+    ('Spend from 2024-11-07 to 2024-11-01', (date(2024, 11, 1), date(2024, 11, 7))),
+    ('Revenue 2024-11-01 - 2024-11-03', (date(2024, 11, 1), date(2024, 11, 3))),
+    ('Revenue last 7 days', (date(2024, 11, 4), date(2024, 11, 10))),
+    ('Spend yesterday', (date(2024, 11, 9), date(2024, 11, 9))),
+    ('Revenue last month', (date(2024, 10, 1), date(2024, 10, 31))),
+    ('Sales on Black Friday', (date(2024, 11, 29), date(2024, 11, 29))),
+    ('Revenue in October 2023', (date(2023, 10, 1), date(2023, 10, 31))),
+])
+def test_parse_time_range(question, expected):
+    assert parse_time_range(question, ANCHOR)[:2] == expected
+
+
+@pytest.mark.parametrize('question', ['What is total spend?', 'Sales in may be down'])
+def test_parse_time_range_without_time_expression(question):
+    assert parse_time_range(question, ANCHOR) is None
+
+
+@pytest.fixture
+def frames():
+    days = [f'2024-11-{d:02d}' for d in range(1, 11)]
+    meta = pd.DataFrame({
+        'Campaign name': ['Brand', 'Black Friday Retargeting'] * 5,
+        'Reporting starts': days,
+        'Amount spent (USD)': [10.0] * 10,
+    })
+    sales = pd.DataFrame({
+        'Day': days,
+        'Product title': ['Hoodie', 'Tee'] * 5,
+        'Total sales': [50.0, 20.0] * 5,
+    })
+    return {'meta': meta, 'sales': sales}, build_index(meta, sales)
+
+
+def test_strip_matched_names_keeps_iso_dates(frames):
+    _, index = frames
+    question = 'Black Friday Retargeting spend on 2024-11-05'
+    text = strip_matched_names(question, {'Campaign name': index['meta']['entities']['Campaign name']})
+    assert 'black' not in text and '2024-11-05' in text
+
+
+def test_context_for_iso_date(frames):
+    dfs, index = frames
+    context = build_relevant_context('How did sales do on 2024-11-05?', dfs, index)
+    assert set(context) == {'meta', 'sales'}
+    assert context['sales'][0].startswith('- Rows matching the question (2024-11-05 (2024-11-05 to 2024-11-05)): 1 of 10')
+
+
+def test_context_for_date_range_and_campaign(frames):
+    dfs, index = frames
+    context = build_relevant_context(
+        'Black Friday Retargeting spend from 2024-11-01 to 2024-11-04', dfs, index)
+    assert 'Campaign name: Black Friday Retargeting' in context['meta'][0]
+    assert context['meta'][0].endswith(': 2 of 10')
+
+
+def test_campaign_name_is_not_read_as_a_date(frames):
+    dfs, index = frames
+    context = build_relevant_context('How is the Black Friday Retargeting campaign doing?', dfs, index)
+    assert list(context) == ['meta']
+    assert context['meta'][0].endswith(': 5 of 10')
+
+
+def test_context_empty_without_entities_or_dates(frames):
+    dfs, index = frames
+    assert build_relevant_context('What is our overall performance?', dfs, index) == {}
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+from row_query import QueryError, parse_query, run_query
+
+
+@pytest.fixture
+def frames():
+    return {'meta': pd.DataFrame({'Campaign': ['A', 'B', 'C'], 'Spend': [3.0, 1.0, 2.0], 'Clicks': [30, 10, 20]})}
+
+
+@pytest.mark.parametrize('body', [
+    {'dataset': ['meta']},
+    {'columns': [{'a': 1}]},
+    {'columns': 'Spend'},
+    {'sort_by': ['Spend']},
+    {'descending': 'false'},
+    {'filters': [{'column': {'a': 1}, 'op': 'eq', 'value': 1}]},
+    {'filters': [{'column': 'Spend', 'op': ['eq'], 'value': 1}]},
+])
+def test_parse_query_rejects_malformed_bodies(frames, body):
+    with pytest.raises(QueryError):
+        parse_query(body, frames)
+
+
+def test_in_filter_needs_scalar_values(frames):
+    query = parse_query({'filters': [{'column': 'Campaign', 'op': 'in', 'value': [{'a': 1}]}]}, frames)
+    with pytest.raises(QueryError):
+        run_query('s', 1, frames, query)
+
+
+def test_page_has_only_requested_columns_in_order(frames):
+    query = parse_query({'columns': ['Spend', 'Campaign'], 'sort_by': 'Spend', 'descending': True,
+                         'filters': [{'column': 'Campaign', 'op': 'in', 'value': ['A', 'C']}]}, frames)
+    page = run_query('s', 1, frames, query)
+    assert page['rows'] == [{'Spend': 3.0, 'Campaign': 'A'}, {'Spend': 2.0, 'Campaign': 'C'}]
+    assert page['total_matches'] == 2 and page['next_cursor'] is None